@@ -1,10 +1,94 @@
 import psycopg2
+import psycopg2.errors
+import psycopg2.extras
+import psycopg2.pool
 import os
+import itertools
+import bisect
+import contextlib
 import math
-import tempfile
+import time
+import multiprocessing
+import weakref
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
 
-def getopenconnection(user='postgres', password='1234', dbname='movie_rating'):
-    return psycopg2.connect("dbname='" + dbname + "' user='" + user + "' host='localhost' password='" + password + "'")
+import instrumentation
+
+COPY_CHUNK_SIZE = 1 << 20
+
+ROUNDROBIN_SLOT_SEQUENCE = 'roundrobin_slot'
+
+# Bytes before the stored offset that are hashed to detect a rewritten source file.
+LOAD_CHECKSUM_WINDOW = 1 << 16
+
+# A ratings.dat line that needs no further checks: ids that fit in INTEGER,
+# a rating in [0, 5] and an integer timestamp. Clean blocks are converted to
+# COPY rows by one subn() over the whole block.
+VALID_RATING_LINE = re.compile(
+    rb'^(\d{1,9})::(\d{1,9})::((?:[0-4](?:\.\d*)?|5(?:\.0*)?|\.\d+))::\d+\r?$', re.MULTILINE)
+
+INT32_MIN = -2 ** 31
+INT32_MAX = 2 ** 31 - 1
+
+# Per-fragment secondary indexes as (access method, column) pairs.
+DEFAULT_FRAGMENT_INDEXES = {
+    'range': [('btree', 'userid'), ('btree', 'movieid'), ('brin', 'rating')],
+    'roundrobin': [('btree', 'userid'), ('btree', 'movieid')],
+}
+
+# connection -> {scheme: (version, partitions, boundaries)}
+_partition_cache = weakref.WeakKeyDictionary()
+
+# connection -> names of the statements PREPAREd on it
+_prepared_statements = weakref.WeakKeyDictionary()
+
+_connection_pool = None
+
+def _dsn(user, password, dbname, host='localhost', port=5432):
+    dsn = "dbname='" + dbname + "' user='" + user + "' host='" + host + "' port='" + str(port) + "'"
+    if password is not None:
+        dsn += " password='" + password + "'"
+    return dsn
+
+def getopenconnection(user='postgres', password='1234', dbname='movie_rating', host='localhost', port=5432):
+    return psycopg2.connect(_dsn(user, password, dbname, host, port))
+
+def init_connection_pool(minconn=1, maxconn=10, user='postgres', password='1234', dbname='movie_rating',
+                         host='localhost', port=5432):
+    global _connection_pool
+    close_connection_pool()
+    _connection_pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, _dsn(user, password, dbname, host, port))
+    return _connection_pool
+
+def close_connection_pool():
+    global _connection_pool
+    if _connection_pool is not None:
+        _connection_pool.closeall()
+        _connection_pool = None
+
+@contextlib.contextmanager
+def pooled_connection():
+    if _connection_pool is None:
+        init_connection_pool()
+    pool = _connection_pool
+    con = pool.getconn()
+    try:
+        yield con
+    finally:
+        pool.putconn(con)
+
+def execute_prepared(cur, name, sql, argtypes, params):
+    # Server-side PREPARE once per connection; Postgres re-analyzes the plan
+    # by itself if a partition is dropped and recreated under the same name.
+    prepared = _prepared_statements.setdefault(cur.connection, set())
+    if name not in prepared:
+        types = f" ({', '.join(argtypes)})" if argtypes else ""
+        cur.execute(f"PREPARE {name}{types} AS {sql}")
+        prepared.add(name)
+    values = f" ({', '.join(['%s'] * len(params))})" if params else ""
+    cur.execute(f"EXECUTE {name}{values}", params)
 
 def create_db(dbname):
     con = getopenconnection(dbname='postgres')
@@ -31,6 +115,17 @@ def get_partition_count(prefix, openconnection):
     count = cur.fetchone()[0]
     return count
 
+def check_not_native(cur, ratingstablename):
+    # native_partitioning turns ratings into a partitioned parent whose
+    # partitions reuse the fragment names: emulated writers would store every
+    # row twice, and rebuilding the fragments would drop its partitions.
+    cur.execute("""
+        SELECT COUNT(*) FROM pg_catalog.pg_partitioned_table
+        WHERE partrelid = to_regclass(%s)
+    """, (ratingstablename,))
+    if cur.fetchone()[0] != 0:
+        raise ValueError(f"{ratingstablename} is partitioned by native_partitioning; use its functions instead")
+
 def validate_rating(rating):
     if not isinstance(rating, (int, float)):
         raise ValueError("Rating must be a number")
@@ -38,94 +133,748 @@ def validate_rating(rating):
         raise ValueError("Rating must be between 0 and 5")
     return float(rating)
 
-def loadratings(ratingstablename, ratingsfilepath, openconnection):
+def parse_rating_line(line):
+    # Full checks for the lines VALID_RATING_LINE does not match.
+    # Returns (copy row, None), (None, reason) or (None, None) for a blank line.
+    stripped = line.strip()
+    if not stripped:
+        return None, None
+    parts = stripped.split(b'::')
+    if len(parts) != 4:
+        return None, f"expected 4 fields, found {len(parts)}"
+    try:
+        userid, movieid, timestamp = int(parts[0]), int(parts[1]), int(parts[3])
+        rating = float(parts[2])
+    except ValueError:
+        return None, "non-numeric field"
+    if not (INT32_MIN <= userid <= INT32_MAX and INT32_MIN <= movieid <= INT32_MAX):
+        return None, "id out of INTEGER range"
+    if not 0 <= rating <= 5:
+        return None, "rating outside [0, 5]"
+    return b'%d\t%d\t%r\n' % (userid, movieid, rating), None
+
+class RatingsFileReader:
+    # File-like adapter for COPY FROM STDIN: converts '::'-delimited lines of
+    # the byte range [start, end) into tab-separated rows one chunk at a time.
+    # Lines that fail validation are skipped, counted, and written to rejects
+    # (an open text file) as "<line number>\t<reason>\t<line>", numbered from
+    # the first line of the range.
+    def __init__(self, ratingsfilepath, start=0, end=None, chunksize=COPY_CHUNK_SIZE, rejects=None):
+        self.file = open(ratingsfilepath, 'rb')
+        self.file.seek(start)
+        self.position = start
+        self.remaining = None if end is None else end - start
+        self.chunksize = chunksize
+        self.rejects = rejects
+        self.pending = b''
+        self.buffer = b''
+        self.eof = False
+        self.rows = 0
+        self.lines = 0
+        self.rejected = 0
+        self.parseseconds = 0.0
+    
+    def _fill(self):
+        size = self.chunksize if self.remaining is None else min(self.chunksize, self.remaining)
+        data = self.file.read(size) if size > 0 else b''
+        self.position += len(data)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        
+        if data:
+            cut = data.rfind(b'\n') + 1
+            if not cut:
+                self.pending += data
+                return
+            block = self.pending + data[:cut]
+            self.pending = data[cut:]
+        else:
+            block = self.pending + b'\n' if self.pending else b''
+            self.pending = b''
+            self.eof = True
+        
+        started = time.perf_counter()
+        self.buffer = self._parse(block)
+        self.parseseconds += time.perf_counter() - started
+    
+    def _parse(self, block):
+        lines = block.count(b'\n')
+        converted, matched = VALID_RATING_LINE.subn(rb'\1\t\2\t\3', block)
+        if matched == lines:
+            self.lines += lines
+            self.rows += matched
+            return converted
+        
+        # Only blocks holding a line the pattern rejects are checked line by line.
+        rows = []
+        for line in block.split(b'\n')[:-1]:
+            self.lines += 1
+            row, reason = parse_rating_line(line)
+            if row is not None:
+                rows.append(row)
+            elif reason is not None:
+                self.rejected += 1
+                if self.rejects is not None:
+                    self.rejects.write(f"{self.lines}\t{reason}\t{line.decode(errors='replace').rstrip()}\n")
+        self.rows += len(rows)
+        return b''.join(rows)
+    
+    def read(self, size=-1):
+        while not self.buffer and not self.eof:
+            self._fill()
+        data, self.buffer = self.buffer, b''
+        return data
+    
+    def close(self):
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+def _ratings_copy_sql(ratingstablename):
+    return f"COPY {ratingstablename} (userid, movieid, rating) FROM STDIN"
+
+def _split_byte_ranges(ratingsfilepath, parts, size=None):
+    if size is None:
+        size = os.path.getsize(ratingsfilepath)
+    offsets = [0]
+    
+    with open(ratingsfilepath, 'rb') as input_file:
+        for i in range(1, parts):
+            input_file.seek(max(size * i // parts, offsets[-1]))
+            input_file.readline()
+            offsets.append(min(input_file.tell(), size))
+    offsets.append(size)
+    
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
+
+def connection_params(openconnection):
+    # Everything getopenconnection needs to reach the same server and database;
+    # password is None when the caller authenticated without one (e.g. .pgpass).
+    info = openconnection.info
+    return {'user': info.user, 'password': info.password, 'dbname': info.dbname,
+            'host': info.host, 'port': info.port}
+
+def _copy_byte_range(args):
+    ratingstablename, ratingsfilepath, start, end, connectionparams, rejectpath = args
+    
+    con = getopenconnection(**connectionparams)
+    try:
+        with contextlib.ExitStack() as stack:
+            rejects = stack.enter_context(open(rejectpath, 'w')) if rejectpath is not None else None
+            reader = stack.enter_context(RatingsFileReader(ratingsfilepath, start, end, rejects=rejects))
+            con.cursor().copy_expert(_ratings_copy_sql(ratingstablename), reader, size=COPY_CHUNK_SIZE)
+        con.commit()
+        return reader.rows, reader.lines, reader.rejected
+    finally:
+        con.close()
+
+def _merge_rejects(rejectfile, parts, linecounts):
+    # Worker reject files number lines from the start of their byte range.
+    with open(rejectfile, 'w') as output:
+        offset = 0
+        for part, lines in zip(parts, linecounts):
+            with open(part) as rejects:
+                for line in rejects:
+                    number, rest = line.split('\t', 1)
+                    output.write(f"{int(number) + offset}\t{rest}")
+            os.remove(part)
+            offset += lines
+
+def finalize_table(tablename, openconnection, indexcolumns=(), setlogged=False, maintenanceworkmem=None):
+    cur = openconnection.cursor()
+    
+    if maintenanceworkmem is not None:
+        cur.execute("SELECT set_config('maintenance_work_mem', %s, true)", (str(maintenanceworkmem),))
+    
+    for column in indexcolumns:
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_{tablename}_{column}
+            ON {tablename} ({column})
+        """)
+    
+    if setlogged:
+        cur.execute(f"ALTER TABLE {tablename} SET LOGGED")
+    
+    cur.execute(f"ANALYZE {tablename}")
+
+def _publish_staging(cur, staging, ratingstablename, created):
+    if created:
+        # Nothing else can have written to a table this load created; swap the heap in.
+        cur.execute(f"DROP TABLE {ratingstablename}")
+        cur.execute(f"ALTER TABLE {staging} RENAME TO {ratingstablename}")
+    else:
+        cur.execute(f"""
+            INSERT INTO {ratingstablename} (userid, movieid, rating)
+            SELECT userid, movieid, rating FROM {staging}
+        """)
+        cur.execute(f"DROP TABLE {staging}")
+
+def loadratings(ratingstablename, ratingsfilepath, openconnection, workers=1, connectionparams=None,
+                unlogged=False, createindex=True, maintenanceworkmem=None, rejectfile=None):
     cur = openconnection.cursor()
     
     USER_ID_COLNAME = 'userid'
     MOVIE_ID_COLNAME = 'movieid'
     RATING_COLNAME = 'rating'
     
+    cur.execute("SELECT to_regclass(%s) IS NULL", (ratingstablename,))
+    created = cur.fetchone()[0]
+    
+    # Staging mode: COPY into a bare unlogged heap; indexes and WAL are paid
+    # once in finalize_table. Only a table created by this call is made
+    # UNLOGGED: switching a populated table would rewrite it, and a crash
+    # during the load would truncate everything loaded before.
+    persistence = 'UNLOGGED ' if unlogged and created else ''
     cur.execute(f"""
-        CREATE TABLE IF NOT EXISTS {ratingstablename} (
+        CREATE {persistence}TABLE IF NOT EXISTS {ratingstablename} (
             {USER_ID_COLNAME} INTEGER,
             {MOVIE_ID_COLNAME} INTEGER,
             {RATING_COLNAME} FLOAT
         );
     """)
     
+    # Parallel workers commit independently, and an existing table must not
+    # turn UNLOGGED, so both load a separate staging table that is published
+    # once every row is in.
+    staged = workers > 1 or (unlogged and not created)
+    staging = f"{ratingstablename}_staging"
+    parts = []
+    
     try:
-        with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-            with open(ratingsfilepath, 'r') as input_file:
-                for line in input_file:
-                    parts = line.strip().split("::")
-                    if len(parts) == 4:
-                        temp_file.write(f"{parts[0]}\t{parts[1]}\t{parts[2]}\n")
+        started = time.perf_counter()
         
-        with open(temp_file.name, 'r') as temp_file:
-            cur.copy_from(temp_file, ratingstablename, sep='\t')
+        # Same rule as loadratings_incremental: a last line still being
+        # written is left for the next incremental load to pick up whole.
+        end = _complete_lines_end(ratingsfilepath)
         
-        os.unlink(temp_file.name)
+        if staged:
+            cur.execute(f"DROP TABLE IF EXISTS {staging}")
+            cur.execute(f"""
+                CREATE UNLOGGED TABLE {staging} (
+                    {USER_ID_COLNAME} INTEGER,
+                    {MOVIE_ID_COLNAME} INTEGER,
+                    {RATING_COLNAME} FLOAT
+                )
+            """)
         
-        cur.execute(f"""
-            CREATE INDEX IF NOT EXISTS idx_{ratingstablename}_rating 
-            ON {ratingstablename} ({RATING_COLNAME})
-        """)
+        if workers > 1:
+            # Each worker COPYs its own byte range on its own connection, so
+            # the staging table has to be visible to them.
+            openconnection.commit()
+            if connectionparams is None:
+                connectionparams = connection_params(openconnection)
+            
+            ranges = _split_byte_ranges(ratingsfilepath, workers, end)
+            parts = [None if rejectfile is None else f"{rejectfile}.part{i}" for i in range(len(ranges))]
+            tasks = [(staging, ratingsfilepath, first, last, connectionparams, part)
+                     for (first, last), part in zip(ranges, parts)]
+            with instrumentation.phase('loadratings.copy'), multiprocessing.Pool(max(1, len(tasks))) as pool:
+                results = pool.map(_copy_byte_range, tasks)
+            rows = sum(result[0] for result in results)
+            rejected = sum(result[2] for result in results)
+            if rejectfile is not None:
+                _merge_rejects(rejectfile, parts, [result[1] for result in results])
+        else:
+            with contextlib.ExitStack() as stack:
+                rejects = stack.enter_context(open(rejectfile, 'w')) if rejectfile is not None else None
+                reader = stack.enter_context(RatingsFileReader(ratingsfilepath, 0, end, rejects=rejects))
+                with instrumentation.phase('loadratings.copy'):
+                    cur.copy_expert(_ratings_copy_sql(staging if staged else ratingstablename), reader,
+                                    size=COPY_CHUNK_SIZE)
+            rows = reader.rows
+            rejected = reader.rejected
+            # Parsing runs inside the COPY, pulled chunk by chunk; this is its share.
+            instrumentation.observe_phase('loadratings.parse', reader.parseseconds)
+        
+        elapsed = time.perf_counter() - started
+        instrumentation.count('loadratings.rows', rows)
+        instrumentation.count('loadratings.rejected', rejected)
         
-        openconnection.commit()
+        if staged:
+            with instrumentation.phase('loadratings.publish'):
+                _publish_staging(cur, staging, ratingstablename, created)
+        
+        with instrumentation.phase('loadratings.finalize'):
+            # A table this call created is still unlogged here, whether it
+            # was created that way or swapped in from the staging heap.
+            finalize_table(ratingstablename, openconnection,
+                           indexcolumns=[RATING_COLNAME] if createindex else [],
+                           setlogged=created and (unlogged or staged), maintenanceworkmem=maintenanceworkmem)
+        
+        save_load_progress(cur, ratingstablename, ratingsfilepath, end, rows)
+        
+        with instrumentation.phase('loadratings.commit'):
+            openconnection.commit()
+        
+        print(f"Loaded {rows} rows into {ratingstablename} in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):.0f} rows/sec)")
+        if rejected:
+            target = f", see {rejectfile}" if rejectfile is not None else ""
+            print(f"Rejected {rejected} invalid lines{target}")
+        unterminated = os.path.getsize(ratingsfilepath) - end
+        if unterminated:
+            print(f"Left {unterminated} bytes after the last newline of {ratingsfilepath} for loadratings_incremental")
+        return rows, rejected
         
     except Exception as e:
         print(f"Error loading data: {e}")
         openconnection.rollback()
+        if workers > 1:
+            # Rows the workers already committed go away with the staging table.
+            cur.execute(f"DROP TABLE IF EXISTS {staging}")
+            openconnection.commit()
+            for part in parts:
+                if part is not None and os.path.exists(part):
+                    os.remove(part)
         raise
 
-def rangepartition(ratingstablename, numberofpartitions, openconnection):
+def _ensure_load_progress(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS load_progress (
+            tablename TEXT NOT NULL,
+            source TEXT NOT NULL,
+            byte_offset BIGINT NOT NULL,
+            checksum TEXT NOT NULL,
+            rows BIGINT NOT NULL,
+            PRIMARY KEY (tablename, source)
+        )
+    """)
+
+def _tail_checksum(ratingsfilepath, offset):
+    with open(ratingsfilepath, 'rb') as input_file:
+        input_file.seek(max(0, offset - LOAD_CHECKSUM_WINDOW))
+        return hashlib.sha256(input_file.read(offset - input_file.tell())).hexdigest()
+
+def save_load_progress(cur, ratingstablename, ratingsfilepath, offset, rows, append=False):
+    _ensure_load_progress(cur)
+    total = "load_progress.rows + EXCLUDED.rows" if append else "EXCLUDED.rows"
+    cur.execute(f"""
+        INSERT INTO load_progress (tablename, source, byte_offset, checksum, rows)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (tablename, source) DO UPDATE
+        SET byte_offset = EXCLUDED.byte_offset, checksum = EXCLUDED.checksum, rows = {total}
+    """, (ratingstablename, os.path.abspath(ratingsfilepath), offset, _tail_checksum(ratingsfilepath, offset), rows))
+
+def _complete_lines_end(ratingsfilepath):
+    # A growing log may end in a line that is still being written; stop after the last newline.
+    with open(ratingsfilepath, 'rb') as input_file:
+        end = input_file.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - COPY_CHUNK_SIZE)
+            input_file.seek(start)
+            newline = input_file.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+        return 0
+
+def loadratings_incremental(ratingstablename, ratingsfilepath, openconnection, rejectfile=None):
     cur = openconnection.cursor()
     
     RANGE_TABLE_PREFIX = 'range_part'
+    RROBIN_TABLE_PREFIX = 'rrobin_part'
     USER_ID_COLNAME = 'userid'
     MOVIE_ID_COLNAME = 'movieid'
     RATING_COLNAME = 'rating'
     
-    for i in range(numberofpartitions):
-        cur.execute(f"DROP TABLE IF EXISTS {RANGE_TABLE_PREFIX}{i}")
-    
-    step = 5.0 / numberofpartitions
+    staging = f"{ratingstablename}_increment"
     
+    try:
+        with instrumentation.phase('loadratings_incremental.prepare'):
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {ratingstablename} (
+                    {USER_ID_COLNAME} INTEGER,
+                    {MOVIE_ID_COLNAME} INTEGER,
+                    {RATING_COLNAME} FLOAT
+                )
+            """)
+            _ensure_partition_metadata(cur)
+            _ensure_load_progress(cur)
+            
+            # Slot sequence before any fragment lock, as in every round-robin writer.
+            cur.execute("SELECT partitions FROM partition_metadata WHERE scheme = 'roundrobin'")
+            roundrobin = cur.fetchone()
+            if roundrobin is not None:
+                lock_roundrobin_slots(cur)
+            # Layout changes rewrite these rows, so they wait until the new rows are in.
+            cur.execute("""
+                SELECT scheme, partitions, boundaries FROM partition_metadata
+                WHERE scheme IN ('range', 'roundrobin') FOR SHARE
+            """)
+            layouts = {scheme: (partitions, boundaries) for scheme, partitions, boundaries in cur.fetchall()}
+            
+            # Concurrent incremental loads of the same file queue up on the progress row.
+            cur.execute("""
+                SELECT byte_offset, checksum FROM load_progress
+                WHERE tablename = %s AND source = %s FOR UPDATE
+            """, (ratingstablename, os.path.abspath(ratingsfilepath)))
+            progress = cur.fetchone()
+            offset = 0
+            if progress is not None:
+                offset, checksum = progress
+                if os.path.getsize(ratingsfilepath) < offset or _tail_checksum(ratingsfilepath, offset) != checksum:
+                    raise ValueError(f"{ratingsfilepath} no longer starts with the data loaded before")
+            
+            end = _complete_lines_end(ratingsfilepath)
+            if end <= offset:
+                openconnection.commit()
+                return 0, 0
+            
+            cur.execute(f"""
+                CREATE TEMP TABLE {staging} (
+                    {USER_ID_COLNAME} INTEGER,
+                    {MOVIE_ID_COLNAME} INTEGER,
+                    {RATING_COLNAME} FLOAT
+                ) ON COMMIT DROP
+            """)
+        
+        # Reject line numbers count from the first line after the resumed offset.
+        with contextlib.ExitStack() as stack:
+            rejects = stack.enter_context(open(rejectfile, 'w')) if rejectfile is not None else None
+            reader = stack.enter_context(RatingsFileReader(ratingsfilepath, offset, end, rejects=rejects))
+            with instrumentation.phase('loadratings_incremental.copy'):
+                cur.copy_expert(_ratings_copy_sql(staging), reader, size=COPY_CHUNK_SIZE)
+        rows = reader.rows
+        rejected = reader.rejected
+        
+        with instrumentation.phase('loadratings_incremental.insert'):
+            cur.execute(f"""
+                INSERT INTO {ratingstablename} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+                SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME} FROM {staging}
+            """)
+            
+            if 'range' in layouts:
+                partitions, boundaries = layouts['range']
+                fanout_insert(cur, range_routing_query(staging, boundaries), RANGE_TABLE_PREFIX, partitions)
+            
+            if 'roundrobin' in layouts:
+                # File order decides the slots, exactly as if every line went through roundrobininsert.
+                partitions, _ = layouts['roundrobin']
+                fanout_insert(cur, f"""
+                    SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME},
+                           nextval('{ROUNDROBIN_SLOT_SEQUENCE}') % {partitions} AS part
+                    FROM (SELECT * FROM {staging} ORDER BY ctid) AS ordered
+                """, RROBIN_TABLE_PREFIX, partitions)
+        
+        save_load_progress(cur, ratingstablename, ratingsfilepath, end, rows, append=True)
+        
+        with instrumentation.phase('loadratings_incremental.commit'):
+            openconnection.commit()
+        instrumentation.count('loadratings_incremental.rows', rows)
+        instrumentation.count('loadratings_incremental.rejected', rejected)
+        
+        print(f"Loaded {rows} new rows from {ratingsfilepath} into {ratingstablename}")
+        if rejected:
+            target = f", see {rejectfile}" if rejectfile is not None else ""
+            print(f"Rejected {rejected} invalid lines{target}")
+        return rows, rejected
+        
+    except Exception as e:
+        openconnection.rollback()
+        raise
+
+def drop_partitions(cur, prefix):
+    cur.execute("""
+        SELECT tablename FROM pg_catalog.pg_tables
+        WHERE schemaname = 'public' AND tablename ~ %s
+    """, (f'^{prefix}[0-9]+$',))
+    for (tablename,) in cur.fetchall():
+        cur.execute(f"DROP TABLE IF EXISTS {tablename}")
+
+def create_partitions(cur, prefix, numberofpartitions, unlogged=True):
+    persistence = 'UNLOGGED ' if unlogged else ''
     for i in range(numberofpartitions):
         cur.execute(f"""
-            CREATE TABLE {RANGE_TABLE_PREFIX}{i} (
-                {USER_ID_COLNAME} INTEGER,
-                {MOVIE_ID_COLNAME} INTEGER,
-                {RATING_COLNAME} FLOAT
+            CREATE {persistence}TABLE {prefix}{i} (
+                userid INTEGER,
+                movieid INTEGER,
+                rating FLOAT
             )
         """)
+
+def fanout_insert(cur, routedquery, prefix, numberofpartitions):
+    # routedquery yields (userid, movieid, rating, part). It is referenced by
+    # every branch, so Postgres evaluates it once and every partition is
+    # filled from that single pass in one writable-CTE statement.
+    branches = [f"routed AS ({routedquery})"]
+    for i in range(numberofpartitions):
+        branches.append(f"""
+            part{i} AS (
+                INSERT INTO {prefix}{i} (userid, movieid, rating)
+                SELECT userid, movieid, rating FROM routed WHERE part = {i}
+            )""")
+    
+    sql = f"""
+        WITH {', '.join(branches)}
+        SELECT COUNT(*) FROM routed
+    """
+    if instrumentation.explain_enabled():
+        plan = instrumentation.explain_analyze(cur, f"fanout_insert {prefix}", sql)
+        rows = instrumentation.outer_rows(plan)
+    else:
+        cur.execute(sql)
+        rows = cur.fetchone()[0]
+    instrumentation.count(f"fanout_insert.{prefix}.rows", rows)
+    return rows
+
+def _fragment_index_name(tablename, method, column):
+    # btree indexes keep the idx_<table>_<column> names finalize_table uses.
+    suffix = '' if method == 'btree' else f"_{method}"
+    return f"idx_{tablename}_{column}{suffix}"
+
+def get_fragment_indexes(tablename, openconnection):
+    # (access method, column) of every single-column index on the table,
+    # found by definition: names go stale when repartitioning renames tables.
+    cur = openconnection.cursor()
+    cur.execute("""
+        SELECT am.amname, a.attname
+        FROM pg_catalog.pg_index i
+        JOIN pg_catalog.pg_class c ON c.oid = i.indexrelid
+        JOIN pg_catalog.pg_am am ON am.oid = c.relam
+        JOIN pg_catalog.pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = to_regclass(%s) AND i.indnatts = 1
+        ORDER BY c.relname
+    """, (tablename,))
+    return [(method, column) for method, column in cur.fetchall()]
+
+def create_fragment_index(cur, tablename, method, column):
+    cur.execute(f"""
+        CREATE INDEX {_fragment_index_name(tablename, method, column)}
+        ON {tablename} USING {method} ({column})
+    """)
+
+def _build_fragment_index(args):
+    tablename, method, column, connectionparams, maintenanceworkmem = args
     
+    con = getopenconnection(**connectionparams)
     try:
-        for i in range(numberofpartitions):
-            lower = i * step
-            upper = (i + 1) * step
-            
-            if i == 0:
-                cur.execute(f"""
-                    INSERT INTO {RANGE_TABLE_PREFIX}{i}
-                    SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME}
-                    FROM {ratingstablename}
-                    WHERE {RATING_COLNAME} >= {lower} AND {RATING_COLNAME} <= {upper}
-                """)
-            else:
-                cur.execute(f"""
-                    INSERT INTO {RANGE_TABLE_PREFIX}{i}
-                    SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME}
-                    FROM {ratingstablename}
-                    WHERE {RATING_COLNAME} > {lower} AND {RATING_COLNAME} <= {upper}
-                """)
-        
-        openconnection.commit()
+        cur = con.cursor()
+        if maintenanceworkmem is not None:
+            cur.execute("SELECT set_config('maintenance_work_mem', %s, true)", (str(maintenanceworkmem),))
+        started = time.perf_counter()
+        if (method, column) not in get_fragment_indexes(tablename, con):
+            create_fragment_index(cur, tablename, method, column)
+        con.commit()
+        return time.perf_counter() - started
+    finally:
+        con.close()
+
+def build_fragment_indexes(prefix, numberofpartitions, indexspecs, openconnection, workers=4, connectionparams=None,
+                           maintenanceworkmem=None):
+    # Every (fragment, index) pair is built on its own connection; CREATE
+    # INDEX only takes a SHARE lock, so builds on one fragment overlap too.
+    if connectionparams is None:
+        connectionparams = connection_params(openconnection)
+    
+    tasks = [(f"{prefix}{i}", method, column, connectionparams, maintenanceworkmem)
+             for i in range(numberofpartitions) for method, column in indexspecs]
+    if not tasks:
+        return {}
+    
+    started = time.perf_counter()
+    with instrumentation.phase(f"build_fragment_indexes.{prefix}"), \
+            ThreadPoolExecutor(max_workers=max(1, min(workers, len(tasks)))) as executor:
+        seconds = list(executor.map(_build_fragment_index, tasks))
+    elapsed = time.perf_counter() - started
+    
+    timings = {_fragment_index_name(tablename, method, column): taken
+               for (tablename, method, column, _, _), taken in zip(tasks, seconds)}
+    print(f"Built {len(tasks)} indexes on {numberofpartitions} {prefix} fragments in {elapsed:.2f}s "
+          f"({sum(seconds):.2f}s of index builds, {workers} workers)")
+    return timings
+
+def _ensure_partition_metadata(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS partition_metadata (
+            scheme TEXT PRIMARY KEY,
+            partitions INTEGER NOT NULL,
+            boundaries FLOAT8[],
+            next_row BIGINT NOT NULL DEFAULT 0,
+            version BIGINT NOT NULL
+        )
+    """)
+
+def lock_roundrobin_slots(cur):
+    # nextval keeps a lock on the sequence until commit and ALTER SEQUENCE
+    # conflicts with it, so this waits for in-flight round-robin inserts and
+    # holds new ones back until the caller commits its layout change. Take it
+    # before locking any fragment: inserters hold it while writing one.
+    cur.execute(f"CREATE SEQUENCE IF NOT EXISTS {ROUNDROBIN_SLOT_SEQUENCE} MINVALUE 0 START 0")
+    cur.execute(f"ALTER SEQUENCE {ROUNDROBIN_SLOT_SEQUENCE} NO CYCLE")
+
+def lock_partition_metadata(cur, scheme):
+    # Lock order for layout changes: slot sequence, then the metadata row,
+    # then fragments; bulk writers that read the row FOR SHARE use the same one.
+    _ensure_partition_metadata(cur)
+    cur.execute("SELECT 1 FROM partition_metadata WHERE scheme = %s FOR UPDATE", (scheme,))
+
+def save_partition_metadata(cur, scheme, numberofpartitions, nextrow=0, boundaries=None):
+    # txid_current() never repeats, so a cached version cannot accidentally
+    # match a layout rebuilt after the metadata table was dropped.
+    _ensure_partition_metadata(cur)
+    if scheme == 'roundrobin':
+        # setval is not undone by a rollback; callers save metadata last, right before commit.
+        lock_roundrobin_slots(cur)
+        cur.execute("SELECT setval(%s, %s, false)", (ROUNDROBIN_SLOT_SEQUENCE, nextrow))
+    cur.execute("""
+        INSERT INTO partition_metadata (scheme, partitions, boundaries, next_row, version)
+        VALUES (%s, %s, %s, %s, txid_current())
+        ON CONFLICT (scheme) DO UPDATE
+        SET partitions = EXCLUDED.partitions, boundaries = EXCLUDED.boundaries,
+            next_row = EXCLUDED.next_row, version = EXCLUDED.version
+    """, (scheme, numberofpartitions, boundaries, nextrow))
+    _partition_cache.get(cur.connection, {}).pop(scheme, None)
+
+def delete_partition_metadata(cur, scheme):
+    _ensure_partition_metadata(cur)
+    cur.execute("DELETE FROM partition_metadata WHERE scheme = %s", (scheme,))
+    _partition_cache.get(cur.connection, {}).pop(scheme, None)
+
+def get_partition_metadata(scheme, openconnection, refresh=False):
+    cache = _partition_cache.setdefault(openconnection, {})
+    
+    if refresh or scheme not in cache:
+        cur = openconnection.cursor()
+        cur.execute("""
+            SELECT version, partitions, boundaries FROM partition_metadata
+            WHERE scheme = %s
+        """, (scheme,))
+        row = cur.fetchone()
+        if row is None:
+            cache.pop(scheme, None)
+            return None
+        cache[scheme] = row
+    
+    return cache[scheme]
+
+def range_boundaries(numberofpartitions):
+    # The last bound is pinned to 5: (N * step) rounds below 5.0 for some N.
+    step = 5.0 / numberofpartitions
+    return [(i + 1) * step for i in range(numberofpartitions - 1)] + [5.0]
+
+def equidepth_boundaries(ratingstablename, numberofpartitions, openconnection, samplepercent=1.0):
+    cur = openconnection.cursor()
+    
+    RATING_COLNAME = 'rating'
+    
+    # Upper bound of partition i is the (i + 1) / N quantile, taken from a
+    # block sample; small tables whose sample comes back empty are read whole.
+    fractions = [(i + 1) / numberofpartitions for i in range(numberofpartitions - 1)]
+    quantiles_sql = f"""
+        SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY {RATING_COLNAME})
+        FROM {ratingstablename}{{sample}}
+        WHERE {RATING_COLNAME} >= 0 AND {RATING_COLNAME} <= 5
+    """
+    
+    quantiles = None
+    if samplepercent:
+        cur.execute(quantiles_sql.format(sample=f" TABLESAMPLE SYSTEM ({float(samplepercent)})"), (fractions,))
+        quantiles = cur.fetchone()[0]
+    if quantiles is None:
+        cur.execute(quantiles_sql.format(sample=''), (fractions,))
+        quantiles = cur.fetchone()[0]
+    if quantiles is None:
+        return range_boundaries(numberofpartitions)
+    
+    # Skewed, discrete ratings can repeat a quantile; the partitions between
+    # equal boundaries simply stay empty. The last one always ends at 5.
+    return [float(quantile) for quantile in quantiles] + [5.0]
+
+def range_routing_query(ratingstablename, boundaries):
+    USER_ID_COLNAME = 'userid'
+    MOVIE_ID_COLNAME = 'movieid'
+    RATING_COLNAME = 'rating'
+    
+    # First partition is [0, upper], every other one is (lower, upper].
+    routing = ' '.join(f"WHEN {RATING_COLNAME} <= {upper} THEN {i}" for i, upper in enumerate(boundaries))
+    return f"""
+        SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME}, CASE {routing} END AS part
+        FROM {ratingstablename}
+        WHERE {RATING_COLNAME} >= 0 AND {RATING_COLNAME} <= {boundaries[-1]}
+    """
+
+def rangepartition(ratingstablename, numberofpartitions, openconnection, equidepth=False, samplepercent=1.0,
+                   indexspecs=None, indexworkers=4):
+    cur = openconnection.cursor()
+    
+    RANGE_TABLE_PREFIX = 'range_part'
+    USER_ID_COLNAME = 'userid'
+    MOVIE_ID_COLNAME = 'movieid'
+    RATING_COLNAME = 'rating'
+    
+    if numberofpartitions <= 0:
+        raise ValueError("Number of partitions must be positive")
+    
+    check_not_native(cur, ratingstablename)
+    if equidepth:
+        boundaries = equidepth_boundaries(ratingstablename, numberofpartitions, openconnection, samplepercent)
+    else:
+        boundaries = range_boundaries(numberofpartitions)
+    
+    with instrumentation.phase('rangepartition.create'):
+        lock_partition_metadata(cur, 'range')
+        drop_partitions(cur, RANGE_TABLE_PREFIX)
+        create_partitions(cur, RANGE_TABLE_PREFIX, numberofpartitions)
+    
+    try:
+        with instrumentation.phase('rangepartition.fanout'):
+            fanout_insert(cur, range_routing_query(ratingstablename, boundaries), RANGE_TABLE_PREFIX,
+                          numberofpartitions)
+        
+        with instrumentation.phase('rangepartition.finalize'):
+            for i in range(numberofpartitions):
+                finalize_table(f"{RANGE_TABLE_PREFIX}{i}", openconnection, setlogged=True)
+        
+        save_partition_metadata(cur, 'range', numberofpartitions, boundaries=boundaries)
+        
+        with instrumentation.phase('rangepartition.commit'):
+            openconnection.commit()
     except Exception as e:
         openconnection.rollback()
         raise
+    
+    # The fragments are committed, so other connections can index them in parallel.
+    if indexspecs:
+        return build_fragment_indexes(RANGE_TABLE_PREFIX, numberofpartitions, indexspecs, openconnection,
+                                      indexworkers)
+
+def _insert_rating(cur, ratingstablename, userid, movieid, rating):
+    execute_prepared(cur, f"insert_{ratingstablename}", f"""
+        INSERT INTO {ratingstablename} (userid, movieid, rating)
+        VALUES ($1, $2, $3)
+    """, ('integer', 'integer', 'float8'), (userid, movieid, rating))
+
+def _range_metadata(ratingstablename, openconnection, refresh=False):
+    cur = openconnection.cursor()
+    
+    RANGE_TABLE_PREFIX = 'range_part'
+    
+    try:
+        metadata = get_partition_metadata('range', openconnection, refresh)
+    except psycopg2.errors.UndefinedTable:
+        openconnection.rollback()
+        metadata = None
+    
+    if metadata is None:
+        check_not_native(cur, ratingstablename)
+        num_partitions = get_partition_count(RANGE_TABLE_PREFIX, openconnection)
+        if num_partitions == 0:
+            rangepartition(ratingstablename, 5, openconnection)
+        else:
+            save_partition_metadata(cur, 'range', num_partitions, boundaries=range_boundaries(num_partitions))
+            openconnection.commit()
+        metadata = get_partition_metadata('range', openconnection, refresh=True)
+    
+    return metadata
 
-def rangeinsert(ratingstablename, userid, movieid, rating, openconnection):
+def rangeinsert(ratingstablename, userid, movieid, rating, openconnection=None):
+    if openconnection is None:
+        with pooled_connection() as con:
+            return rangeinsert(ratingstablename, userid, movieid, rating, con)
+    
     cur = openconnection.cursor()
     
     RANGE_TABLE_PREFIX = 'range_part'
@@ -135,34 +884,58 @@ def rangeinsert(ratingstablename, userid, movieid, rating, openconnection):
     
     rating = validate_rating(rating)
     
-    num_partitions = get_partition_count(RANGE_TABLE_PREFIX, openconnection)
-    
-    if num_partitions == 0:
-        rangepartition(ratingstablename, 5, openconnection)
-        num_partitions = 5
-    
-    step = 5.0 / num_partitions
-    partition_index = int(rating / step)
-    if rating % step == 0 and partition_index != 0:
-        partition_index = partition_index - 1
-    
     try:
-        cur.execute(f"""
-            INSERT INTO {ratingstablename} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
-            VALUES (%s, %s, %s)
-        """, (userid, movieid, rating))
+        with instrumentation.phase('rangeinsert.metadata'):
+            metadata = _range_metadata(ratingstablename, openconnection)
         
-        cur.execute(f"""
-            INSERT INTO {RANGE_TABLE_PREFIX}{partition_index} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
-            VALUES (%s, %s, %s)
-        """, (userid, movieid, rating))
+        while True:
+            version, num_partitions, boundaries = metadata
+            
+            # First boundary >= rating, i.e. the (lower, upper] range that holds it.
+            partition_index = bisect.bisect_left(boundaries, rating)
+            
+            # The fragment insert only happens if the cached layout is still
+            # current; otherwise reload the metadata and route again.
+            try:
+                with instrumentation.phase('rangeinsert.insert'):
+                    execute_prepared(cur, f"insert_{RANGE_TABLE_PREFIX}{partition_index}", f"""
+                        INSERT INTO {RANGE_TABLE_PREFIX}{partition_index} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+                        SELECT $1, $2, $3
+                        WHERE EXISTS (SELECT 1 FROM partition_metadata WHERE scheme = 'range' AND version = $4)
+                    """, ('integer', 'integer', 'float8', 'bigint'), (userid, movieid, rating, version))
+                if cur.rowcount == 1:
+                    break
+            except psycopg2.errors.UndefinedTable:
+                openconnection.rollback()
+            instrumentation.count('rangeinsert.retries')
+            with instrumentation.phase('rangeinsert.metadata'):
+                metadata = _range_metadata(ratingstablename, openconnection, refresh=True)
+            if metadata[0] == version:
+                # The layout did not change, so retrying cannot bring the fragment back.
+                raise ValueError(f"Range layout {version} has no {RANGE_TABLE_PREFIX}{partition_index}")
+        
+        with instrumentation.phase('rangeinsert.insert'):
+            _insert_rating(cur, ratingstablename, userid, movieid, rating)
         
-        openconnection.commit()
+        with instrumentation.phase('rangeinsert.commit'):
+            openconnection.commit()
+        instrumentation.count('rangeinsert.rows')
     except Exception as e:
         openconnection.rollback()
         raise e
 
-def roundrobinpartition(ratingstablename, numberofpartitions, openconnection):
+def roundrobin_routing_query(ratingstablename, numberofpartitions):
+    USER_ID_COLNAME = 'userid'
+    MOVIE_ID_COLNAME = 'movieid'
+    RATING_COLNAME = 'rating'
+    
+    return f"""
+        SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME},
+               (ROW_NUMBER() OVER (ORDER BY ctid) - 1) % {numberofpartitions} AS part
+        FROM {ratingstablename}
+    """
+
+def roundrobinpartition(ratingstablename, numberofpartitions, openconnection, indexspecs=None, indexworkers=4):
     cur = openconnection.cursor()
     
     RROBIN_TABLE_PREFIX = 'rrobin_part'
@@ -170,70 +943,222 @@ def roundrobinpartition(ratingstablename, numberofpartitions, openconnection):
     MOVIE_ID_COLNAME = 'movieid'
     RATING_COLNAME = 'rating'
     
-    for i in range(numberofpartitions):
-        cur.execute(f"DROP TABLE IF EXISTS {RROBIN_TABLE_PREFIX}{i}")
+    if numberofpartitions <= 0:
+        raise ValueError("Number of partitions must be positive")
     
-    for i in range(numberofpartitions):
-        cur.execute(f"""
-            CREATE TABLE {RROBIN_TABLE_PREFIX}{i} (
-                {USER_ID_COLNAME} INTEGER,
-                {MOVIE_ID_COLNAME} INTEGER,
-                {RATING_COLNAME} FLOAT
-            )
-        """)
+    check_not_native(cur, ratingstablename)
+    with instrumentation.phase('roundrobinpartition.create'):
+        lock_roundrobin_slots(cur)
+        lock_partition_metadata(cur, 'roundrobin')
+        drop_partitions(cur, RROBIN_TABLE_PREFIX)
+        create_partitions(cur, RROBIN_TABLE_PREFIX, numberofpartitions)
     
     try:
-        for i in range(numberofpartitions):
-            cur.execute(f"""
-                INSERT INTO {RROBIN_TABLE_PREFIX}{i}
-                SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME}
-                FROM (
-                    SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME},
-                           (ROW_NUMBER() OVER (ORDER BY ctid) - 1) % {numberofpartitions} as partition_id
-                    FROM {ratingstablename}
-                ) as distributed_data
-                WHERE partition_id = {i}
-            """)
+        # Rows are numbered once; the total becomes the slot of the next insert.
+        with instrumentation.phase('roundrobinpartition.fanout'):
+            total_rows = fanout_insert(cur, roundrobin_routing_query(ratingstablename, numberofpartitions),
+                                       RROBIN_TABLE_PREFIX, numberofpartitions)
+        
+        with instrumentation.phase('roundrobinpartition.finalize'):
+            for i in range(numberofpartitions):
+                finalize_table(f"{RROBIN_TABLE_PREFIX}{i}", openconnection, setlogged=True)
+        
+        save_partition_metadata(cur, 'roundrobin', numberofpartitions, total_rows)
         
-        openconnection.commit()
+        with instrumentation.phase('roundrobinpartition.commit'):
+            openconnection.commit()
     except Exception as e:
         openconnection.rollback()
         raise
+    
+    if indexspecs:
+        return build_fragment_indexes(RROBIN_TABLE_PREFIX, numberofpartitions, indexspecs, openconnection,
+                                      indexworkers)
+
+def _claim_roundrobin_slots(cur, count=1):
+    # nextval hands every row its own slot without making inserters wait for
+    # each other. The layout cannot change while the sequence lock is held
+    # (see lock_roundrobin_slots), so the partition count read afterwards is
+    # the one the slots belong to.
+    execute_prepared(cur, "claim_roundrobin_slots", f"""
+        SELECT nextval('{ROUNDROBIN_SLOT_SEQUENCE}') FROM generate_series(1, $1)
+    """, ('bigint',), (count,))
+    slots = [row[0] for row in cur.fetchall()]
+    execute_prepared(cur, "roundrobin_partitions", """
+        SELECT partitions FROM partition_metadata WHERE scheme = 'roundrobin'
+    """, (), ())
+    row = cur.fetchone()
+    return None if row is None else (row[0], slots)
 
-def roundrobininsert(ratingstablename, userid, itemid, rating, openconnection):
+def _roundrobin_slots(ratingstablename, openconnection, count=1):
     cur = openconnection.cursor()
     
     RROBIN_TABLE_PREFIX = 'rrobin_part'
-    USER_ID_COLNAME = 'userid'
-    MOVIE_ID_COLNAME = 'movieid'
-    RATING_COLNAME = 'rating'
     
-    rating = validate_rating(rating)
+    try:
+        slot = _claim_roundrobin_slots(cur, count)
+    except psycopg2.errors.UndefinedTable:
+        slot = None
     
-    num_partitions = get_partition_count(RROBIN_TABLE_PREFIX, openconnection)
+    if slot is None:
+        # Slots claimed before finding no metadata are discarded; the resync below resets the sequence.
+        openconnection.rollback()
+        check_not_native(cur, ratingstablename)
+        num_partitions = get_partition_count(RROBIN_TABLE_PREFIX, openconnection)
+        if num_partitions == 0:
+            roundrobinpartition(ratingstablename, 5, openconnection)
+        else:
+            # Partitions predate the metadata table: resync the counter once.
+            cur.execute(f"SELECT COUNT(*) FROM {ratingstablename}")
+            save_partition_metadata(cur, 'roundrobin', num_partitions, cur.fetchone()[0])
+            openconnection.commit()
+        slot = _claim_roundrobin_slots(cur, count)
     
-    if num_partitions == 0:
-        roundrobinpartition(ratingstablename, 5, openconnection)
-        num_partitions = 5
+    return slot
+
+def roundrobininsert(ratingstablename, userid, itemid, rating, openconnection=None):
+    if openconnection is None:
+        with pooled_connection() as con:
+            return roundrobininsert(ratingstablename, userid, itemid, rating, con)
     
-    cur.execute(f"SELECT COUNT(*) FROM {ratingstablename}")
-    total_rows = cur.fetchone()[0]
+    cur = openconnection.cursor()
     
-    next_partition = total_rows % num_partitions
+    RROBIN_TABLE_PREFIX = 'rrobin_part'
+    USER_ID_COLNAME = 'userid'
+    MOVIE_ID_COLNAME = 'movieid'
+    RATING_COLNAME = 'rating'
+    
+    rating = validate_rating(rating)
     
     try:
-        cur.execute(f"""
-            INSERT INTO {ratingstablename} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
-            VALUES (%s, %s, %s)
-        """, (userid, itemid, rating))
+        with instrumentation.phase('roundrobininsert.slot'):
+            num_partitions, slots = _roundrobin_slots(ratingstablename, openconnection)
+        next_partition = slots[0] % num_partitions
         
-        cur.execute(f"""
-            INSERT INTO {RROBIN_TABLE_PREFIX}{next_partition}
-            ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
-            VALUES (%s, %s, %s)
-        """, (userid, itemid, rating))
+        with instrumentation.phase('roundrobininsert.insert'):
+            _insert_rating(cur, ratingstablename, userid, itemid, rating)
+            
+            execute_prepared(cur, f"insert_{RROBIN_TABLE_PREFIX}{next_partition}", f"""
+                INSERT INTO {RROBIN_TABLE_PREFIX}{next_partition}
+                ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+                VALUES ($1, $2, $3)
+            """, ('integer', 'integer', 'float8'), (userid, itemid, rating))
         
-        openconnection.commit()
+        with instrumentation.phase('roundrobininsert.commit'):
+            openconnection.commit()
+        instrumentation.count('roundrobininsert.rows')
     except Exception as e:
         openconnection.rollback()
-        raise e
\ No newline at end of file
+        raise e
+
+def _batches(rows, batchsize):
+    rows = iter(rows)
+    while True:
+        batch = [(userid, movieid, validate_rating(rating))
+                 for userid, movieid, rating in itertools.islice(rows, batchsize)]
+        if not batch:
+            return
+        yield batch
+
+def _insert_ratings(cur, ratingstablename, batch):
+    psycopg2.extras.execute_values(cur, f"""
+        INSERT INTO {ratingstablename} (userid, movieid, rating) VALUES %s
+    """, batch, page_size=len(batch))
+
+def rangeinsert_many(ratingstablename, rows, openconnection=None, batchsize=10000):
+    if openconnection is None:
+        with pooled_connection() as con:
+            return rangeinsert_many(ratingstablename, rows, con, batchsize)
+    
+    cur = openconnection.cursor()
+    
+    RANGE_TABLE_PREFIX = 'range_part'
+    
+    inserted = 0
+    for batch in _batches(rows, batchsize):
+        try:
+            metadata = _range_metadata(ratingstablename, openconnection)
+            
+            while True:
+                version, num_partitions, boundaries = metadata
+                
+                buckets = {}
+                for row in batch:
+                    buckets.setdefault(bisect.bisect_left(boundaries, row[2]), []).append(row)
+                
+                # Same version guard as rangeinsert: if any bucket lands on a
+                # rebuilt layout, undo the batch and route it again.
+                stale = False
+                try:
+                    with instrumentation.phase('rangeinsert_many.insert'):
+                        for partition_index, bucket in buckets.items():
+                            psycopg2.extras.execute_values(cur, f"""
+                                INSERT INTO {RANGE_TABLE_PREFIX}{partition_index} (userid, movieid, rating)
+                                SELECT * FROM (VALUES %s) AS v
+                                WHERE EXISTS (SELECT 1 FROM partition_metadata WHERE scheme = 'range' AND version = {int(version)})
+                            """, bucket, page_size=len(bucket))
+                            if cur.rowcount != len(bucket):
+                                stale = True
+                                break
+                except psycopg2.errors.UndefinedTable:
+                    stale = True
+                
+                if not stale:
+                    break
+                openconnection.rollback()
+                instrumentation.count('rangeinsert_many.retries')
+                metadata = _range_metadata(ratingstablename, openconnection, refresh=True)
+                if metadata[0] == version:
+                    raise ValueError(f"Range layout {version} is missing one of its {RANGE_TABLE_PREFIX} fragments")
+            
+            with instrumentation.phase('rangeinsert_many.insert'):
+                _insert_ratings(cur, ratingstablename, batch)
+            
+            with instrumentation.phase('rangeinsert_many.commit'):
+                openconnection.commit()
+        except Exception as e:
+            openconnection.rollback()
+            raise e
+        inserted += len(batch)
+        instrumentation.count('rangeinsert_many.rows', len(batch))
+    
+    return inserted
+
+def roundrobininsert_many(ratingstablename, rows, openconnection=None, batchsize=10000):
+    if openconnection is None:
+        with pooled_connection() as con:
+            return roundrobininsert_many(ratingstablename, rows, con, batchsize)
+    
+    cur = openconnection.cursor()
+    
+    RROBIN_TABLE_PREFIX = 'rrobin_part'
+    
+    inserted = 0
+    for batch in _batches(rows, batchsize):
+        try:
+            # One claim covers the whole batch; row j gets slots[j], so the batch
+            # lands exactly as len(batch) sequential roundrobininsert calls would.
+            with instrumentation.phase('roundrobininsert_many.slot'):
+                num_partitions, slots = _roundrobin_slots(ratingstablename, openconnection, len(batch))
+            
+            buckets = {}
+            for slot, row in zip(slots, batch):
+                buckets.setdefault(slot % num_partitions, []).append(row)
+            
+            with instrumentation.phase('roundrobininsert_many.insert'):
+                for partition_index, bucket in buckets.items():
+                    psycopg2.extras.execute_values(cur, f"""
+                        INSERT INTO {RROBIN_TABLE_PREFIX}{partition_index} (userid, movieid, rating) VALUES %s
+                    """, bucket, page_size=len(bucket))
+                
+                _insert_ratings(cur, ratingstablename, batch)
+            
+            with instrumentation.phase('roundrobininsert_many.commit'):
+                openconnection.commit()
+        except Exception as e:
+            openconnection.rollback()
+            raise e
+        inserted += len(batch)
+        instrumentation.count('roundrobininsert_many.rows', len(batch))
+    
+    return inserted
\ No newline at end of file
@@ -0,0 +1,345 @@
+#
+# asyncio variant of the assignment API on asyncpg.
+#
+# Every function takes an asyncpg pool instead of an open connection, so a
+# service can keep thousands of inserts in flight on a bounded number of
+# connections. asyncpg prepares and caches statements per connection on its
+# own. Partition builds fill the fragments concurrently on several pooled
+# connections while a separate layout transaction holds inserts back, so the
+# pool needs at least two connections.
+#
+
+import asyncio
+import bisect
+import contextlib
+
+import asyncpg
+
+from Group9_Assignment import (COPY_CHUNK_SIZE, ROUNDROBIN_SLOT_SEQUENCE, RatingsFileReader, range_boundaries,
+                               validate_rating)
+
+RANGE_TABLE_PREFIX = 'range_part'
+RROBIN_TABLE_PREFIX = 'rrobin_part'
+USER_ID_COLNAME = 'userid'
+MOVIE_ID_COLNAME = 'movieid'
+RATING_COLNAME = 'rating'
+
+# pool -> {scheme: (version, partitions, boundaries)}
+_partition_cache = {}
+
+# pool -> lock serializing the default layouts created by inserts
+_default_layout_locks = {}
+
+
+async def create_pool(minsize=1, maxsize=10, user='postgres', password='1234', dbname='movie_rating'):
+    return await asyncpg.create_pool(user=user, password=password, database=dbname, host='localhost',
+                                     min_size=minsize, max_size=maxsize)
+
+
+async def _read_chunks(ratingsfilepath):
+    # File reads and '::' conversion run on the default executor so the
+    # event loop keeps serving other coroutines during a load.
+    loop = asyncio.get_running_loop()
+    with RatingsFileReader(ratingsfilepath) as reader:
+        while True:
+            chunk = await loop.run_in_executor(None, reader.read, COPY_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def loadratings(ratingstablename, ratingsfilepath, pool):
+    async with pool.acquire() as con:
+        async with con.transaction():
+            await con.execute(f"""
+                CREATE TABLE IF NOT EXISTS {ratingstablename} (
+                    {USER_ID_COLNAME} INTEGER,
+                    {MOVIE_ID_COLNAME} INTEGER,
+                    {RATING_COLNAME} FLOAT
+                )
+            """)
+            await con.copy_to_table(ratingstablename, source=_read_chunks(ratingsfilepath),
+                                    columns=[USER_ID_COLNAME, MOVIE_ID_COLNAME, RATING_COLNAME], format='text')
+            await con.execute(f"""
+                CREATE INDEX IF NOT EXISTS idx_{ratingstablename}_{RATING_COLNAME}
+                ON {ratingstablename} ({RATING_COLNAME})
+            """)
+
+
+async def _ensure_partition_metadata(con):
+    # Same table and versioning as Group9_Assignment.save_partition_metadata.
+    await con.execute("""
+        CREATE TABLE IF NOT EXISTS partition_metadata (
+            scheme TEXT PRIMARY KEY,
+            partitions INTEGER NOT NULL,
+            boundaries FLOAT8[],
+            next_row BIGINT NOT NULL DEFAULT 0,
+            version BIGINT NOT NULL
+        )
+    """)
+
+
+async def _save_partition_metadata(con, scheme, numberofpartitions, nextrow=0, boundaries=None):
+    # Runs inside the layout transaction, after _lock_layout.
+    if scheme == 'roundrobin':
+        await con.execute("SELECT setval($1, $2, false)", ROUNDROBIN_SLOT_SEQUENCE, nextrow)
+    await con.execute("""
+        INSERT INTO partition_metadata (scheme, partitions, boundaries, next_row, version)
+        VALUES ($1, $2, $3, $4, txid_current())
+        ON CONFLICT (scheme) DO UPDATE
+        SET partitions = EXCLUDED.partitions, boundaries = EXCLUDED.boundaries,
+            next_row = EXCLUDED.next_row, version = EXCLUDED.version
+    """, scheme, numberofpartitions, boundaries, nextrow)
+
+
+async def _lock_roundrobin_slots(con):
+    # See Group9_Assignment.lock_roundrobin_slots.
+    await con.execute(f"CREATE SEQUENCE IF NOT EXISTS {ROUNDROBIN_SLOT_SEQUENCE} MINVALUE 0 START 0")
+    await con.execute(f"ALTER SEQUENCE {ROUNDROBIN_SLOT_SEQUENCE} NO CYCLE")
+
+
+async def _lock_layout(con, scheme, ratingstablename):
+    # See Group9_Assignment.check_not_native.
+    if await con.fetchval("""
+        SELECT EXISTS (SELECT 1 FROM pg_catalog.pg_partitioned_table WHERE partrelid = to_regclass($1))
+    """, ratingstablename):
+        raise ValueError(f"{ratingstablename} is partitioned by native_partitioning; use its functions instead")
+
+    # Same order as the blocking layout changes: slot sequence, metadata row,
+    # then tables. The async inserts write ratings before any fragment, so
+    # the ratings lock holds them back until the new layout is committed;
+    # it also keeps the source rows still while the fragments are filled and
+    # makes concurrent layout changes wait for each other.
+    if scheme == 'roundrobin':
+        await _lock_roundrobin_slots(con)
+    await _ensure_partition_metadata(con)
+    await con.execute("SELECT 1 FROM partition_metadata WHERE scheme = $1 FOR UPDATE", scheme)
+    await con.execute(f"LOCK TABLE {ratingstablename} IN SHARE ROW EXCLUSIVE MODE")
+
+
+async def _drop_fragments(con, prefix):
+    stale = await con.fetch("""
+        SELECT tablename FROM pg_catalog.pg_tables
+        WHERE schemaname = 'public' AND tablename ~ $1
+    """, f'^{prefix}[0-9]+$')
+    for row in stale:
+        await con.execute(f"DROP TABLE IF EXISTS {row['tablename']}")
+
+
+async def _create_fragments(con, prefix, numberofpartitions):
+    # On a fill connection and committed right away, so every fill connection sees them.
+    async with con.transaction():
+        await _drop_fragments(con, prefix)
+        for i in range(numberofpartitions):
+            await con.execute(f"""
+                CREATE TABLE {prefix}{i} (
+                    {USER_ID_COLNAME} INTEGER,
+                    {MOVIE_ID_COLNAME} INTEGER,
+                    {RATING_COLNAME} FLOAT
+                )
+            """)
+
+
+async def _publish_fragments(con, prefix, numberofpartitions):
+    await _drop_fragments(con, prefix)
+    for i in range(numberofpartitions):
+        await con.execute(f"ALTER TABLE new_{prefix}{i} RENAME TO {prefix}{i}")
+
+
+async def _fill_partitions(connections, fills):
+    # fills is a list of (table name, SELECT); each connection takes the next one in turn.
+    pending = iter(fills)
+
+    async def fill(con):
+        for tablename, query in pending:
+            await con.execute(f"""
+                INSERT INTO {tablename} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+                {query}
+            """)
+            await con.execute(f"ANALYZE {tablename}")
+
+    await asyncio.gather(*(fill(con) for con in connections))
+
+
+@contextlib.asynccontextmanager
+async def _layout_connections(pool, workers):
+    # The layout connection plus up to workers fill connections, all taken from
+    # the pool before any lock: inserts queued behind the layout lock keep
+    # their connections, so fills could otherwise wait on the pool forever.
+    workers = min(workers, pool.get_max_size() - 1)
+    if workers < 1:
+        raise ValueError("Partitioning needs a pool of at least two connections")
+    async with contextlib.AsyncExitStack() as stack:
+        con = await stack.enter_async_context(pool.acquire())
+        fillers = [await stack.enter_async_context(pool.acquire()) for _ in range(workers)]
+        yield con, fillers
+
+
+async def rangepartition(ratingstablename, numberofpartitions, pool, workers=4):
+    """
+    Fragments are built under new_ names and filled concurrently on up to workers connections
+    while one transaction holds back inserts; that transaction then swaps them in and saves
+    the metadata.
+    """
+    if numberofpartitions <= 0:
+        raise ValueError("Number of partitions must be positive")
+
+    boundaries = range_boundaries(numberofpartitions)
+    fills = []
+    lower = None
+    for i, upper in enumerate(boundaries):
+        bound = f"{RATING_COLNAME} >= 0" if lower is None else f"{RATING_COLNAME} > {lower}"
+        fills.append((f"new_{RANGE_TABLE_PREFIX}{i}", f"""
+            SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME} FROM {ratingstablename}
+            WHERE {bound} AND {RATING_COLNAME} <= {upper}
+        """))
+        lower = upper
+
+    async with _layout_connections(pool, workers) as (con, fillers):
+        try:
+            async with con.transaction():
+                await _lock_layout(con, 'range', ratingstablename)
+                await _create_fragments(fillers[0], f"new_{RANGE_TABLE_PREFIX}", numberofpartitions)
+                await _fill_partitions(fillers, fills)
+                await _publish_fragments(con, RANGE_TABLE_PREFIX, numberofpartitions)
+                await _save_partition_metadata(con, 'range', numberofpartitions, boundaries=boundaries)
+        finally:
+            await _drop_fragments(con, f"new_{RANGE_TABLE_PREFIX}")
+    _partition_cache.get(pool, {}).pop('range', None)
+
+
+async def roundrobinpartition(ratingstablename, numberofpartitions, pool, workers=4):
+    """
+    Rows are numbered once into an unlogged staging table and the fragments are filled from it
+    concurrently on up to workers connections, while one transaction holds back inserts; that
+    transaction then swaps the new fragments in and saves the metadata.
+    """
+    if numberofpartitions <= 0:
+        raise ValueError("Number of partitions must be positive")
+
+    staging = f"{ratingstablename}_rrobin_staging"
+    fills = [(f"new_{RROBIN_TABLE_PREFIX}{i}", f"""
+                SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME} FROM {staging}
+                WHERE row_number % {numberofpartitions} = {i}
+                ORDER BY row_number
+            """) for i in range(numberofpartitions)]
+
+    async with _layout_connections(pool, workers) as (con, fillers):
+        try:
+            async with con.transaction():
+                await _lock_layout(con, 'roundrobin', ratingstablename)
+                await _create_fragments(fillers[0], f"new_{RROBIN_TABLE_PREFIX}", numberofpartitions)
+
+                await fillers[0].execute(f"DROP TABLE IF EXISTS {staging}")
+                await fillers[0].execute(f"""
+                    CREATE UNLOGGED TABLE {staging} AS
+                    SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME},
+                           (ROW_NUMBER() OVER (ORDER BY ctid) - 1) AS row_number
+                    FROM {ratingstablename}
+                """)
+                total_rows = await fillers[0].fetchval(f"SELECT COUNT(*) FROM {staging}")
+
+                await _fill_partitions(fillers, fills)
+                await _publish_fragments(con, RROBIN_TABLE_PREFIX, numberofpartitions)
+                await _save_partition_metadata(con, 'roundrobin', numberofpartitions, total_rows)
+        finally:
+            await con.execute(f"DROP TABLE IF EXISTS {staging}")
+            await _drop_fragments(con, f"new_{RROBIN_TABLE_PREFIX}")
+
+
+async def _create_default_layout(scheme, ratingstablename, pool, partitionfunction):
+    # Inserts that find no layout queue here and only the first one builds it.
+    async with _default_layout_locks.setdefault(pool, asyncio.Lock()):
+        async with pool.acquire() as con:
+            exists = await con.fetchval("SELECT to_regclass('partition_metadata') IS NOT NULL")
+            if exists:
+                exists = await con.fetchval("SELECT EXISTS (SELECT 1 FROM partition_metadata WHERE scheme = $1)",
+                                            scheme)
+        if not exists:
+            await partitionfunction(ratingstablename, 5, pool)
+
+
+async def _range_metadata(ratingstablename, pool, refresh=False):
+    cache = _partition_cache.setdefault(pool, {})
+    if refresh or 'range' not in cache:
+        async with pool.acquire() as con:
+            try:
+                row = await con.fetchrow("""
+                    SELECT version, partitions, boundaries FROM partition_metadata
+                    WHERE scheme = 'range'
+                """)
+            except asyncpg.exceptions.UndefinedTableError:
+                row = None
+        if row is None:
+            await _create_default_layout('range', ratingstablename, pool, rangepartition)
+            return await _range_metadata(ratingstablename, pool, refresh=True)
+        cache['range'] = tuple(row)
+    return cache['range']
+
+
+class _StaleLayout(Exception):
+    # Rolls back an insert routed with an outdated layout.
+    pass
+
+
+async def rangeinsert(ratingstablename, userid, movieid, rating, pool):
+    rating = validate_rating(rating)
+
+    metadata = await _range_metadata(ratingstablename, pool)
+    while True:
+        version, _, boundaries = metadata
+        partition_index = bisect.bisect_left(boundaries, rating)
+        try:
+            # The connection goes back to the pool before any metadata refresh,
+            # which may have to build the default layout on pooled connections.
+            async with pool.acquire() as con:
+                async with con.transaction():
+                    # ratings first: a layout change in progress holds this back, so the
+                    # guard below already sees the version it commits.
+                    await con.execute(f"""
+                        INSERT INTO {ratingstablename} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+                        VALUES ($1, $2, $3)
+                    """, userid, movieid, rating)
+                    # Version-guarded like the blocking rangeinsert: no row means the layout changed.
+                    status = await con.execute(f"""
+                        INSERT INTO {RANGE_TABLE_PREFIX}{partition_index} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+                        SELECT $1::integer, $2::integer, $3::float8
+                        WHERE EXISTS (SELECT 1 FROM partition_metadata WHERE scheme = 'range' AND version = $4)
+                    """, userid, movieid, rating, version)
+                    if not status.endswith(' 1'):
+                        raise _StaleLayout()
+            return
+        except (_StaleLayout, asyncpg.exceptions.UndefinedTableError):
+            pass
+        metadata = await _range_metadata(ratingstablename, pool, refresh=True)
+        if metadata[0] == version:
+            raise ValueError(f"Range layout {version} has no {RANGE_TABLE_PREFIX}{partition_index}")
+
+
+async def roundrobininsert(ratingstablename, userid, itemid, rating, pool):
+    rating = validate_rating(rating)
+
+    async with pool.acquire() as con:
+        try:
+            async with con.transaction():
+                # Slot first, partition count second; see Group9_Assignment._claim_roundrobin_slots.
+                row_number = await con.fetchval(f"SELECT nextval('{ROUNDROBIN_SLOT_SEQUENCE}')")
+                num_partitions = await con.fetchval("""
+                    SELECT partitions FROM partition_metadata WHERE scheme = 'roundrobin'
+                """)
+                if num_partitions is not None:
+                    await con.execute(f"""
+                        INSERT INTO {ratingstablename} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+                        VALUES ($1, $2, $3)
+                    """, userid, itemid, rating)
+                    await con.execute(f"""
+                        INSERT INTO {RROBIN_TABLE_PREFIX}{row_number % num_partitions}
+                        ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+                        VALUES ($1, $2, $3)
+                    """, userid, itemid, rating)
+                    return
+        except asyncpg.exceptions.UndefinedTableError:
+            pass
+
+    await _create_default_layout('roundrobin', ratingstablename, pool, roundrobinpartition)
+    await roundrobininsert(ratingstablename, userid, itemid, rating, pool)
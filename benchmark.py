@@ -0,0 +1,207 @@
+#
+# Non-interactive benchmark for the load, partition and insert paths.
+#
+# Every dataset is loaded into a scratch database, partitioned with each N,
+# and then used for single and batched inserts. Results are written as one
+# JSON document so that runs can be diffed against each other.
+#
+# Usage: python benchmark.py [--datasets ml-10m synthetic-1m] [--partitions 5 20 100] [--output results.json]
+#
+
+DATABASE_NAME = 'benchmark'
+
+RATINGS_TABLE = 'ratings'
+RANGE_TABLE_PREFIX = 'range_part'
+RROBIN_TABLE_PREFIX = 'rrobin_part'
+
+ML10M_RATINGS_PATH = 'ml-10m/ml-10M100K/ratings.dat'
+SYNTHETIC_DATASETS = {'synthetic-1m': 1000000, 'synthetic-10m': 10000000, 'synthetic-50m': 50000000}
+
+# Id ranges of ML-10M, so synthetic rows look like the real file.
+MAX_USER_ID = 71567
+MAX_MOVIE_ID = 65133
+RATING_WEIGHTS = [0.01, 0.04, 0.02, 0.08, 0.04, 0.24, 0.09, 0.29, 0.06, 0.13]
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import Group9_Assignment as Assignment
+
+
+def generate_ratings(path, rows, seed=0):
+    """
+    Write rows synthetic ratings in the ratings.dat format (userid::movieid::rating::timestamp).
+    Ratings are half stars with roughly the ML-10M distribution.
+    """
+    rng = random.Random(seed)
+    ratings = [f"{(i + 1) / 2:g}" for i in range(len(RATING_WEIGHTS))]
+    with open(path, 'w') as output:
+        written = 0
+        while written < rows:
+            count = min(100000, rows - written)
+            chosen = rng.choices(ratings, RATING_WEIGHTS, k=count)
+            output.write(''.join(
+                f"{rng.randint(1, MAX_USER_ID)}::{rng.randint(1, MAX_MOVIE_ID)}::{rating}::{rng.randint(789652009, 1231131736)}\n"
+                for rating in chosen))
+            written += count
+
+
+def dataset_path(name, datadir):
+    if name == 'ml-10m':
+        if not os.path.exists(ML10M_RATINGS_PATH):
+            raise FileNotFoundError(f"{ML10M_RATINGS_PATH} not found; extract ratings.dat from the ML-10M archive")
+        return ML10M_RATINGS_PATH
+    if name in SYNTHETIC_DATASETS:
+        path = os.path.join(datadir, f"{name}.dat")
+        if not os.path.exists(path):
+            os.makedirs(datadir, exist_ok=True)
+            print(f"Generating {path}", file=sys.stderr)
+            generate_ratings(path + '.tmp', SYNTHETIC_DATASETS[name])
+            os.replace(path + '.tmp', path)
+        return path
+    if os.path.exists(name):
+        return name
+    raise ValueError(f"Unknown dataset: {name}")
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def latency_summary(samples, rows):
+    """
+    p50/p99/max latency in milliseconds and rows/sec for a list of per-call durations in seconds.
+    """
+    total = sum(samples)
+    return {
+        'calls': len(samples),
+        'rows': rows,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'max_ms': max(samples) * 1000,
+        'rows_per_sec': rows / total if total else None,
+    }
+
+
+def reset(openconnection):
+    cur = openconnection.cursor()
+    Assignment.drop_partitions(cur, RANGE_TABLE_PREFIX)
+    Assignment.drop_partitions(cur, RROBIN_TABLE_PREFIX)
+    cur.execute(f"DROP TABLE IF EXISTS {RATINGS_TABLE}")
+    cur.execute("DROP TABLE IF EXISTS partition_metadata")
+    openconnection.commit()
+
+
+def bench_load(path, openconnection, workers):
+    reset(openconnection)
+    started = time.perf_counter()
+    rows, rejected = Assignment.loadratings(RATINGS_TABLE, path, openconnection, workers=workers)
+    elapsed = time.perf_counter() - started
+    return {'rows': rows, 'rejected': rejected, 'seconds': elapsed, 'rows_per_sec': rows / elapsed,
+            'bytes': os.path.getsize(path), 'workers': workers}
+
+
+def bench_partition(partitionfunction, numberofpartitions, openconnection):
+    started = time.perf_counter()
+    partitionfunction(RATINGS_TABLE, numberofpartitions, openconnection)
+    return {'partitions': numberofpartitions, 'seconds': time.perf_counter() - started}
+
+
+def sample_rows(count, rng):
+    return [(rng.randint(1, MAX_USER_ID), rng.randint(1, MAX_MOVIE_ID), rng.randrange(11) / 2) for _ in range(count)]
+
+
+def bench_single_inserts(insertfunction, rows, openconnection):
+    samples = []
+    for userid, movieid, rating in rows:
+        started = time.perf_counter()
+        insertfunction(RATINGS_TABLE, userid, movieid, rating, openconnection)
+        samples.append(time.perf_counter() - started)
+    return latency_summary(samples, len(rows))
+
+
+def bench_batched_inserts(insertfunction, rows, batchsize, openconnection):
+    samples = []
+    for start in range(0, len(rows), batchsize):
+        batch = rows[start:start + batchsize]
+        started = time.perf_counter()
+        insertfunction(RATINGS_TABLE, batch, openconnection, batchsize)
+        samples.append(time.perf_counter() - started)
+    summary = latency_summary(samples, len(rows))
+    summary['batchsize'] = batchsize
+    return summary
+
+
+def bench_dataset(path, openconnection, args, rng):
+    result = {'path': path, 'load': bench_load(path, openconnection, args.workers)}
+
+    # The last N of each scheme stays in place for the insert benchmarks.
+    result['rangepartition'] = [bench_partition(Assignment.rangepartition, n, openconnection)
+                                for n in args.partitions]
+    result['roundrobinpartition'] = [bench_partition(Assignment.roundrobinpartition, n, openconnection)
+                                     for n in args.partitions]
+
+    rows = sample_rows(args.inserts, rng)
+    batched = sample_rows(args.batches * args.batchsize, rng)
+    result['rangeinsert'] = bench_single_inserts(Assignment.rangeinsert, rows, openconnection)
+    result['roundrobininsert'] = bench_single_inserts(Assignment.roundrobininsert, rows, openconnection)
+    result['rangeinsert_many'] = bench_batched_inserts(Assignment.rangeinsert_many, batched, args.batchsize,
+                                                       openconnection)
+    result['roundrobininsert_many'] = bench_batched_inserts(Assignment.roundrobininsert_many, batched,
+                                                            args.batchsize, openconnection)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load, partition and insert benchmark')
+    parser.add_argument('--datasets', nargs='+', default=['ml-10m'],
+                        help='ml-10m, synthetic-1m, synthetic-10m, synthetic-50m or a ratings.dat path')
+    parser.add_argument('--partitions', nargs='+', type=int, default=[5, 20, 100])
+    parser.add_argument('--inserts', type=int, default=1000, help='single inserts per scheme')
+    parser.add_argument('--batchsize', type=int, default=1000)
+    parser.add_argument('--batches', type=int, default=20, help='batched inserts per scheme')
+    parser.add_argument('--workers', type=int, default=1, help='loadratings workers')
+    parser.add_argument('--datadir', default='benchmark_data', help='where synthetic datasets are cached')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON output file; stdout when omitted')
+    args = parser.parse_args()
+
+    Assignment.create_db(DATABASE_NAME)
+    conn = Assignment.getopenconnection(dbname=DATABASE_NAME)
+    cur = conn.cursor()
+    cur.execute("SHOW server_version")
+    server_version = cur.fetchone()[0]
+    conn.commit()
+
+    report = {
+        'started': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'postgres': server_version,
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'datasets': {},
+    }
+
+    rng = random.Random(args.seed)
+    try:
+        # Progress lines from the assignment functions go to stderr so stdout stays valid JSON.
+        with contextlib.redirect_stdout(sys.stderr):
+            for name in args.datasets:
+                print(f"Benchmarking {name}")
+                report['datasets'][name] = bench_dataset(dataset_path(name, args.datadir), conn, args, rng)
+    finally:
+        conn.close()
+
+    document = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(document + '\n')
+    else:
+        print(document)
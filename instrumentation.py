@@ -0,0 +1,244 @@
+#
+# Lightweight instrumentation for the load, partition and insert paths.
+#
+# Group9_Assignment reports phase timings and row counts through phase() and
+# count(); both are no-ops until enable() installs a Metrics registry, so the
+# hot paths pay one global lookup when instrumentation is off. SQL statement
+# timing needs the connection's cursors to be InstrumentedCursor, which
+# instrument_connection() sets up. With explain=True the partitioning
+# statements run under EXPLAIN (ANALYZE, BUFFERS) and their plans are kept.
+#
+
+import contextlib
+import json
+import re
+import threading
+import time
+
+import psycopg2.extensions
+
+METRIC_PREFIX = 'group9'
+
+_metrics = None
+_explain = False
+
+
+class Metrics:
+    """
+    Thread-safe registry of phase timers, row counters, SQL statement timings and captured plans.
+    Listeners are called as listener(kind, name, value) for every observation, with kind one of
+    'phase', 'counter' or 'sql'.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.counters = {}
+        self.statements = {}
+        self.plans = {}
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _notify(self, kind, name, value):
+        for listener in self.listeners:
+            listener(kind, name, value)
+
+    @staticmethod
+    def _observe(table, name, seconds):
+        calls, total, maximum = table.get(name, (0, 0.0, 0.0))
+        table[name] = (calls + 1, total + seconds, max(maximum, seconds))
+
+    def observe_phase(self, name, seconds):
+        with self.lock:
+            self._observe(self.phases, name, seconds)
+        self._notify('phase', name, seconds)
+
+    def observe_statement(self, name, seconds):
+        with self.lock:
+            self._observe(self.statements, name, seconds)
+        self._notify('sql', name, seconds)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        self._notify('counter', name, value)
+
+    def add_plan(self, name, plan):
+        with self.lock:
+            self.plans.setdefault(name, []).append(plan)
+
+    def reset(self):
+        with self.lock:
+            self.phases.clear()
+            self.counters.clear()
+            self.statements.clear()
+            self.plans.clear()
+
+    def as_dict(self):
+        def timings(table):
+            return {name: {'calls': calls, 'seconds': total, 'max_seconds': maximum}
+                    for name, (calls, total, maximum) in sorted(table.items())}
+
+        with self.lock:
+            return {'phases': timings(self.phases), 'counters': dict(sorted(self.counters.items())),
+                    'statements': timings(self.statements), 'plans': dict(self.plans)}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+    def to_prometheus(self):
+        """
+        Prometheus text exposition format; plans are not exported.
+        """
+        def escape(value):
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        lines = []
+
+        def family(name, kind, label, samples):
+            if not samples:
+                return
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+            for key, value in samples:
+                lines.append(f'{METRIC_PREFIX}_{name}{{{label}="{escape(key)}"}} {value}')
+
+        with self.lock:
+            phases = sorted(self.phases.items())
+            statements = sorted(self.statements.items())
+            counters = sorted(self.counters.items())
+
+        family('phase_seconds_total', 'counter', 'phase', [(k, v[1]) for k, v in phases])
+        family('phase_calls_total', 'counter', 'phase', [(k, v[0]) for k, v in phases])
+        family('phase_max_seconds', 'gauge', 'phase', [(k, v[2]) for k, v in phases])
+        family('sql_seconds_total', 'counter', 'statement', [(k, v[1]) for k, v in statements])
+        family('sql_calls_total', 'counter', 'statement', [(k, v[0]) for k, v in statements])
+        family('sql_max_seconds', 'gauge', 'statement', [(k, v[2]) for k, v in statements])
+        family('events_total', 'counter', 'name', counters)
+        return '\n'.join(lines) + '\n'
+
+
+def enable(metrics=None, explain=False):
+    """
+    Start collecting into metrics (a new Metrics when omitted).
+    :param explain: Run the partitioning statements under EXPLAIN (ANALYZE, BUFFERS) and keep their plans
+    :return: The active Metrics
+    """
+    global _metrics, _explain
+    _metrics = metrics if metrics is not None else Metrics()
+    _explain = explain
+    return _metrics
+
+
+def disable():
+    global _metrics, _explain
+    _metrics = None
+    _explain = False
+
+
+def metrics():
+    return _metrics
+
+
+def explain_enabled():
+    return _metrics is not None and _explain
+
+
+@contextlib.contextmanager
+def _timed_phase(registry, name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe_phase(name, time.perf_counter() - started)
+
+
+def phase(name):
+    """
+    Context manager timing one phase, e.g. with phase('loadratings.copy'): ...
+    """
+    if _metrics is None:
+        return contextlib.nullcontext()
+    return _timed_phase(_metrics, name)
+
+
+def observe_phase(name, seconds):
+    if _metrics is not None:
+        _metrics.observe_phase(name, seconds)
+
+
+def count(name, value=1):
+    if _metrics is not None:
+        _metrics.count(name, value)
+
+
+def statement_name(sql):
+    """
+    Short label for a SQL statement: its first three words, with numbers folded so that
+    range_part0..range_part99 share one label.
+    """
+    if isinstance(sql, bytes):
+        sql = sql.decode(errors='replace')
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    words = [word.split('(')[0] for word in sql.split()[:3]]
+    return re.sub(r'[0-9]+', '#', ' '.join(word for word in words if word))
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """
+    Cursor that reports the duration of every execute, executemany and copy_expert call.
+    """
+
+    def _timed(self, method, sql, *args, **kwargs):
+        registry = _metrics
+        if registry is None:
+            return method(sql, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return method(sql, *args, **kwargs)
+        finally:
+            registry.observe_statement(statement_name(sql), time.perf_counter() - started)
+
+    def execute(self, query, vars=None):
+        return self._timed(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._timed(super().executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._timed(super().copy_expert, sql, file, size)
+
+
+def instrument_connection(openconnection):
+    """
+    Make every cursor later opened on openconnection report SQL timings.
+    """
+    openconnection.cursor_factory = InstrumentedCursor
+    return openconnection
+
+
+def explain_analyze(cur, name, sql, params=None):
+    """
+    Run sql under EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) and store the plan under name.
+    The statement is executed for real; its own result rows are not returned.
+    :return: The top plan node
+    """
+    cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    if _metrics is not None:
+        _metrics.add_plan(name, plan)
+    return plan[0]['Plan']
+
+
+def outer_rows(plan):
+    """
+    Rows fed into the top plan node from its main input, e.g. the rows counted by SELECT COUNT(*).
+    """
+    for child in plan.get('Plans', []):
+        if child.get('Parent Relationship') == 'Outer':
+            return child['Actual Rows']
+    return plan['Actual Rows']
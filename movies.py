@@ -0,0 +1,189 @@
+#
+# Movie metadata from movies.dat and top-N queries over the rating fragments.
+#
+# movies.dat (movieid::title::genre|genre|...) is streamed into movies, with
+# the genres normalized into genres and movie_genres. top_movies() computes
+# per-movie partial COUNT/SUM on every fragment in parallel through the
+# scatter-gather aggregate engine, picks the top N from the merged partials
+# with a heap, and joins only those N movies to their metadata.
+#
+
+import heapq
+import re
+
+from Group9_Assignment import COPY_CHUNK_SIZE, pooled_connection
+from partition_aggregate import aggregate_partitions
+from partition_query import build_predicate, partition_tables
+
+MOVIE_ID_COLNAME = 'movieid'
+
+NO_GENRES = '(no genres listed)'
+YEAR_PATTERN = re.compile(r'\((\d{4})\)\s*$')
+ORDERINGS = {
+    'avg': lambda aggregate: (aggregate.avg, aggregate.count),
+    'count': lambda aggregate: (aggregate.count, aggregate.avg),
+}
+
+
+def _copy_text(value):
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class _CopyLines:
+    """
+    File-like source for copy_expert over an iterator of COPY text lines.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def read(self, size=-1):
+        chunk = []
+        length = 0
+        for line in self.lines:
+            chunk.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        return ''.join(chunk).encode()
+
+
+def _movie_lines(moviesfilepath, encoding, genreids, moviegenres):
+    with open(moviesfilepath, encoding=encoding) as input_file:
+        for line in input_file:
+            parts = line.rstrip('\r\n').split('::', 2)
+            if len(parts) != 3:
+                continue
+            movieid, title, genres = int(parts[0]), parts[1], parts[2]
+            year = YEAR_PATTERN.search(title)
+            year = year.group(1) if year else '\\N'
+            for genre in genres.split('|'):
+                if genre and genre != NO_GENRES:
+                    moviegenres.append((movieid, genreids.setdefault(genre, len(genreids) + 1)))
+            yield f"{movieid}\t{_copy_text(title)}\t{year}\n"
+
+
+def loadmovies(moviesfilepath, openconnection, encoding='utf-8'):
+    """
+    Replace the movies, genres and movie_genres tables with the contents of movies.dat.
+    :return: Number of movies loaded
+    """
+    cur = openconnection.cursor()
+
+    try:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS movies (
+                movieid INTEGER PRIMARY KEY,
+                title TEXT NOT NULL,
+                year INTEGER
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS genres (
+                genreid INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS movie_genres (
+                movieid INTEGER NOT NULL REFERENCES movies,
+                genreid INTEGER NOT NULL REFERENCES genres,
+                PRIMARY KEY (movieid, genreid)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_movie_genres_genreid ON movie_genres (genreid)")
+        cur.execute("TRUNCATE movie_genres, genres, movies")
+
+        # Genre ids are assigned while the movies stream through COPY; the
+        # genre and link rows are small enough to be sent afterwards.
+        genreids = {}
+        moviegenres = []
+        cur.copy_expert("COPY movies (movieid, title, year) FROM STDIN",
+                        _CopyLines(_movie_lines(moviesfilepath, encoding, genreids, moviegenres)),
+                        size=COPY_CHUNK_SIZE)
+        movies = cur.rowcount
+        cur.copy_expert("COPY genres (genreid, name) FROM STDIN",
+                        _CopyLines(f"{genreid}\t{_copy_text(name)}\n" for name, genreid in genreids.items()))
+        cur.copy_expert("COPY movie_genres (movieid, genreid) FROM STDIN",
+                        _CopyLines(f"{movieid}\t{genreid}\n" for movieid, genreid in moviegenres),
+                        size=COPY_CHUNK_SIZE)
+
+        for tablename in ('movies', 'genres', 'movie_genres'):
+            cur.execute(f"ANALYZE {tablename}")
+        openconnection.commit()
+    except Exception:
+        openconnection.rollback()
+        raise
+
+    print(f"Loaded {movies} movies with {len(genreids)} genres")
+    return movies
+
+
+def genre_movieids(genre, openconnection):
+    cur = openconnection.cursor()
+    cur.execute("""
+        SELECT mg.movieid FROM movie_genres mg JOIN genres g USING (genreid)
+        WHERE g.name = %s
+    """, (genre,))
+    return [movieid for (movieid,) in cur.fetchall()]
+
+
+def movie_details(movieids, openconnection):
+    """
+    :return: {movieid: (title, year, [genre, ...])}
+    """
+    cur = openconnection.cursor()
+    cur.execute("""
+        SELECT m.movieid, m.title, m.year,
+               COALESCE(array_agg(g.name ORDER BY g.name) FILTER (WHERE g.name IS NOT NULL), '{}')
+        FROM movies m
+        LEFT JOIN movie_genres mg USING (movieid)
+        LEFT JOIN genres g USING (genreid)
+        WHERE m.movieid = ANY(%s)
+        GROUP BY m.movieid, m.title, m.year
+    """, (list(movieids),))
+    return {movieid: (title, year, genres) for movieid, title, year, genres in cur.fetchall()}
+
+
+def _top_movies(n, genre, minratings, orderby, scheme, minrating, maxrating, openconnection, workers):
+    tables = partition_tables(scheme, openconnection, minrating, maxrating)
+    predicate, params = build_predicate(minrating, maxrating)
+    if genre is not None:
+        movieids = genre_movieids(genre, openconnection)
+        if not movieids:
+            return []
+        predicate += (' AND ' if predicate else ' WHERE ') + f"{MOVIE_ID_COLNAME} = ANY(%s)"
+        params.append(movieids)
+
+    merged = aggregate_partitions(tables, 'movieid', predicate, params, bucketwidth=None, workers=workers)
+    key = ORDERINGS[orderby]
+    top = heapq.nlargest(n, ((key(aggregate), movieid, aggregate) for movieid, aggregate in merged.items()
+                             if aggregate.count >= minratings))
+
+    details = movie_details([movieid for _, movieid, _ in top], openconnection)
+    results = []
+    for _, movieid, aggregate in top:
+        title, year, genres = details.get(movieid, (None, None, []))
+        results.append({'movieid': movieid, 'title': title, 'year': year, 'genres': genres,
+                        'count': aggregate.count, 'avg': aggregate.avg})
+    return results
+
+
+def top_movies(n=10, genre=None, minratings=1, orderby='avg', scheme='range', minrating=None, maxrating=None,
+               openconnection=None, workers=4):
+    """
+    Top n movies by average rating or by number of ratings, optionally within one genre.
+    :param minratings: Ignore movies with fewer ratings than this
+    :param orderby: 'avg' (ties broken by count) or 'count' (ties broken by avg)
+    :param scheme: Fragments to aggregate over, 'range' or 'roundrobin'
+    :param minrating: Inclusive lower bound on the ratings counted; prunes range fragments
+    :param maxrating: Inclusive upper bound on the ratings counted; prunes range fragments
+    :param openconnection: Used for metadata lookups; fragments are read on pooled connections
+    :return: List of dicts with movieid, title, year, genres, count and avg, best first
+    """
+    if orderby not in ORDERINGS:
+        raise ValueError(f"Cannot order by {orderby}")
+    if openconnection is None:
+        with pooled_connection() as con:
+            return _top_movies(n, genre, minratings, orderby, scheme, minrating, maxrating, con, workers)
+    return _top_movies(n, genre, minratings, orderby, scheme, minrating, maxrating, openconnection, workers)
@@ -0,0 +1,179 @@
+#
+# Alternate backend built on PostgreSQL declarative partitioning.
+#
+# The ratings table itself becomes the partitioned parent and range_part{i} /
+# rrobin_part{i} are attached partitions of it, so inserts go straight to the
+# parent, the server routes every row and queries on ratings are pruned.
+# The layouts are recorded as 'native_range' and 'hash', never as the emulated
+# 'range' / 'roundrobin' schemes whose writers also fill the fragments.
+# The function signatures match Group9_Assignment, so either module can be
+# passed to the testHelper functions.
+#
+
+import math
+import weakref
+
+from Group9_Assignment import (getopenconnection, create_db, loadratings, validate_rating, range_boundaries,
+                               drop_partitions, execute_prepared, finalize_table, save_partition_metadata,
+                               delete_partition_metadata, lock_roundrobin_slots)
+
+RANGE_TABLE_PREFIX = 'range_part'
+RROBIN_TABLE_PREFIX = 'rrobin_part'
+USER_ID_COLNAME = 'userid'
+MOVIE_ID_COLNAME = 'movieid'
+RATING_COLNAME = 'rating'
+
+# connection -> names of ratings tables already known to be partitioned
+_partitioned_tables = weakref.WeakKeyDictionary()
+
+
+def range_partition_bounds(numberofpartitions):
+    """
+    Translate the assignment's [0, b0], (b0, b1], ... ranges into Postgres' [from, to) bounds.
+    A float8 x satisfies x <= b exactly when x < nextafter(b, inf), so the boundaries stay identical.
+    :param numberofpartitions: Number of range partitions
+    :return: List of (from, to) float pairs, one per partition
+    """
+    bounds = []
+    lower = 0.0
+    for upper in range_boundaries(numberofpartitions):
+        bounds.append((lower, math.nextafter(upper, math.inf)))
+        lower = math.nextafter(upper, math.inf)
+    return bounds
+
+
+def _rebuild_as_partitioned(ratingstablename, partitionby, partitions, openconnection):
+    """
+    Replace ratingstablename with a partitioned parent holding the same rows.
+    The new layout is built under temporary names and swapped in inside the caller's transaction.
+    :param partitionby: PARTITION BY clause, e.g. 'RANGE (rating)'
+    :param partitions: List of (partition name, FOR VALUES clause)
+    """
+    cur = openconnection.cursor()
+    staging = f"{ratingstablename}_partitioned"
+
+    # Every earlier layout's metadata describes fragments dropped below; the
+    # caller saves the new one. Same lock order as the emulated layout
+    # changes: slot sequence, metadata rows, fragments.
+    lock_roundrobin_slots(cur)
+    for scheme in ('range', 'roundrobin', 'native_range', 'hash'):
+        delete_partition_metadata(cur, scheme)
+
+    # User triggers (e.g. the rating_summaries one) move to the new parent.
+    cur.execute("""
+        SELECT pg_catalog.pg_get_triggerdef(oid) FROM pg_catalog.pg_trigger
+        WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal
+    """, (ratingstablename,))
+    triggers = [definition for (definition,) in cur.fetchall()]
+
+    cur.execute(f"DROP TABLE IF EXISTS {staging} CASCADE")
+    cur.execute(f"""
+        CREATE TABLE {staging} (
+            {USER_ID_COLNAME} INTEGER,
+            {MOVIE_ID_COLNAME} INTEGER,
+            {RATING_COLNAME} FLOAT
+        ) PARTITION BY {partitionby}
+    """)
+    for name, bound in partitions:
+        cur.execute(f"CREATE TABLE {name}_new PARTITION OF {staging} {bound}")
+
+    cur.execute(f"""
+        INSERT INTO {staging} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+        SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME} FROM {ratingstablename}
+    """)
+
+    # Dropping a partitioned parent also drops its old partitions; emulated
+    # fragments left behind by the other backend are removed explicitly.
+    cur.execute(f"DROP TABLE {ratingstablename}")
+    drop_partitions(cur, RANGE_TABLE_PREFIX)
+    drop_partitions(cur, RROBIN_TABLE_PREFIX)
+
+    cur.execute(f"ALTER TABLE {staging} RENAME TO {ratingstablename}")
+    for name, bound in partitions:
+        cur.execute(f"ALTER TABLE {name}_new RENAME TO {name}")
+    for definition in triggers:
+        cur.execute(definition)
+
+    finalize_table(ratingstablename, openconnection, indexcolumns=[RATING_COLNAME])
+    _partitioned_tables.setdefault(openconnection, set()).add(ratingstablename)
+
+
+def _ensure_partitioned(ratingstablename, openconnection, partitionfunction):
+    known = _partitioned_tables.setdefault(openconnection, set())
+    if ratingstablename in known:
+        return
+
+    cur = openconnection.cursor()
+    cur.execute("""
+        SELECT COUNT(*) FROM pg_catalog.pg_partitioned_table
+        WHERE partrelid = to_regclass(%s)
+    """, (ratingstablename,))
+    if cur.fetchone()[0] == 0:
+        partitionfunction(ratingstablename, 5, openconnection)
+    known.add(ratingstablename)
+
+
+def rangepartition(ratingstablename, numberofpartitions, openconnection):
+    if numberofpartitions <= 0:
+        raise ValueError("Number of partitions must be positive")
+
+    partitions = [(f"{RANGE_TABLE_PREFIX}{i}", f"FOR VALUES FROM ('{lower!r}') TO ('{upper!r}')")
+                  for i, (lower, upper) in enumerate(range_partition_bounds(numberofpartitions))]
+    # Negative or > 5 ratings are not part of any range, as in the emulated backend.
+    partitions.append((f"{ratingstablename}_out_of_range", "DEFAULT"))
+
+    try:
+        _rebuild_as_partitioned(ratingstablename, f"RANGE ({RATING_COLNAME})", partitions,
+                                openconnection)
+        save_partition_metadata(openconnection.cursor(), 'native_range', numberofpartitions,
+                                boundaries=range_boundaries(numberofpartitions))
+        openconnection.commit()
+    except Exception:
+        openconnection.rollback()
+        raise
+
+
+def roundrobinpartition(ratingstablename, numberofpartitions, openconnection):
+    """
+    Round-robin equivalent: hash partitioning on (userid, movieid).
+    Fragments are balanced statistically rather than to within one row, and the row-to-fragment
+    assignment differs from ROW_NUMBER() order.
+    """
+    if numberofpartitions <= 0:
+        raise ValueError("Number of partitions must be positive")
+
+    partitions = [(f"{RROBIN_TABLE_PREFIX}{i}", f"FOR VALUES WITH (MODULUS {numberofpartitions}, REMAINDER {i})")
+                  for i in range(numberofpartitions)]
+
+    try:
+        _rebuild_as_partitioned(ratingstablename, f"HASH ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME})", partitions,
+                                openconnection)
+        save_partition_metadata(openconnection.cursor(), 'hash', numberofpartitions)
+        openconnection.commit()
+    except Exception:
+        openconnection.rollback()
+        raise
+
+
+def _insert_into_parent(ratingstablename, userid, movieid, rating, openconnection, partitionfunction):
+    cur = openconnection.cursor()
+    rating = validate_rating(rating)
+
+    try:
+        _ensure_partitioned(ratingstablename, openconnection, partitionfunction)
+        execute_prepared(cur, f"insert_{ratingstablename}", f"""
+            INSERT INTO {ratingstablename} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+            VALUES ($1, $2, $3)
+        """, ('integer', 'integer', 'float8'), (userid, movieid, rating))
+        openconnection.commit()
+    except Exception:
+        openconnection.rollback()
+        raise
+
+
+def rangeinsert(ratingstablename, userid, movieid, rating, openconnection):
+    _insert_into_parent(ratingstablename, userid, movieid, rating, openconnection, rangepartition)
+
+
+def roundrobininsert(ratingstablename, userid, itemid, rating, openconnection):
+    _insert_into_parent(ratingstablename, userid, itemid, rating, openconnection, roundrobinpartition)
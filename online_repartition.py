@@ -0,0 +1,317 @@
+#
+# Online repartitioning: change the number (or boundaries) of range_part /
+# rrobin_part fragments while they stay readable and writable.
+#
+# 1. A trigger on every fragment that will change logs concurrent inserts.
+# 2. The new layout is built in shadow_<prefix>{i} tables from the current
+#    fragments only (never from the master ratings table) inside one
+#    REPEATABLE READ snapshot; log rows visible in that snapshot are discarded.
+# 3. One short transaction locks the old fragments against writers, replays
+#    the remaining log rows into the shadows, and swaps names plus metadata.
+#
+
+import psycopg2.errors
+
+from Group9_Assignment import (create_fragment_index, create_partitions, fanout_insert, finalize_table,
+                               get_fragment_indexes, get_partition_metadata, lock_partition_metadata,
+                               lock_roundrobin_slots, range_boundaries, save_partition_metadata)
+
+RANGE_TABLE_PREFIX = 'range_part'
+RROBIN_TABLE_PREFIX = 'rrobin_part'
+USER_ID_COLNAME = 'userid'
+MOVIE_ID_COLNAME = 'movieid'
+RATING_COLNAME = 'rating'
+
+LOG_TABLE = 'repartition_log'
+CAPTURE_FUNCTION = 'repartition_capture'
+
+
+def _range_intervals(boundaries):
+    # (lower, upper] per partition; lower is None for the first one, which starts at 0.
+    return list(zip([None] + list(boundaries[:-1]), boundaries))
+
+
+def _overlaps(a, b):
+    lowers = [bound for bound in (a[0], b[0]) if bound is not None]
+    return (max(lowers) if lowers else float('-inf')) < min(a[1], b[1])
+
+
+def _range_filter(interval):
+    lower, upper = interval
+    if lower is None:
+        return f"{RATING_COLNAME} >= 0 AND {RATING_COLNAME} <= {upper}"
+    return f"{RATING_COLNAME} > {lower} AND {RATING_COLNAME} <= {upper}"
+
+
+def plan_range_repartition(oldboundaries, newboundaries):
+    """
+    Decide which new range partitions can reuse an old table unchanged and which old tables feed the others.
+    :return: (reused, sources) where reused maps new index -> old index and sources maps every
+             other new index -> list of old indexes whose rows it takes
+    """
+    old = _range_intervals(oldboundaries)
+    new = _range_intervals(newboundaries)
+
+    # Each old table can be renamed into place only once. Empty intervals, which
+    # repeated equi-depth boundaries produce, are never reused; they get a new
+    # empty table, since no old one overlaps them.
+    reusable = {}
+    for i, interval in enumerate(old):
+        if interval[0] != interval[1]:
+            reusable.setdefault(interval, i)
+
+    reused = {}
+    sources = {}
+    for j, interval in enumerate(new):
+        if interval in reusable:
+            reused[j] = reusable.pop(interval)
+        else:
+            sources[j] = [i for i, oldinterval in enumerate(old) if _overlaps(oldinterval, interval)]
+    return reused, sources
+
+
+def _install_capture(cur, prefix, partitions):
+    cur.execute(f"""
+        CREATE TABLE {LOG_TABLE} (
+            id BIGSERIAL PRIMARY KEY,
+            part INTEGER NOT NULL,
+            {USER_ID_COLNAME} INTEGER,
+            {MOVIE_ID_COLNAME} INTEGER,
+            {RATING_COLNAME} FLOAT
+        )
+    """)
+    cur.execute(f"""
+        CREATE OR REPLACE FUNCTION {CAPTURE_FUNCTION}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO {LOG_TABLE} (part, {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+            VALUES (TG_ARGV[0]::integer, NEW.{USER_ID_COLNAME}, NEW.{MOVIE_ID_COLNAME}, NEW.{RATING_COLNAME});
+            RETURN NULL;
+        END
+        $$
+    """)
+    for i in partitions:
+        cur.execute(f"""
+            CREATE TRIGGER {CAPTURE_FUNCTION}_{prefix}{i} AFTER INSERT ON {prefix}{i}
+            FOR EACH ROW EXECUTE PROCEDURE {CAPTURE_FUNCTION}('{i}')
+        """)
+
+
+def _start_capture(openconnection, prefix, partitions):
+    # The log table also marks a running repartition: a second one cannot
+    # create it, and fails before touching the first one's triggers and shadows.
+    cur = openconnection.cursor()
+    try:
+        _install_capture(cur, prefix, partitions)
+        openconnection.commit()
+    except (psycopg2.errors.DuplicateTable, psycopg2.errors.UniqueViolation):
+        openconnection.rollback()
+        raise ValueError(f"Another repartition is using {LOG_TABLE}; drop it if that run was interrupted")
+    except Exception:
+        openconnection.rollback()
+        raise
+
+
+def _current_layout(scheme, openconnection):
+    try:
+        metadata = get_partition_metadata(scheme, openconnection, refresh=True)
+    except psycopg2.errors.UndefinedTable:
+        metadata = None
+    openconnection.rollback()
+    if metadata is None:
+        raise ValueError(f"No {scheme} partitions to repartition")
+    return metadata
+
+
+def _cleanup(openconnection, prefix, oldpartitions, newpartitions):
+    openconnection.rollback()
+    cur = openconnection.cursor()
+    for i in range(oldpartitions):
+        cur.execute(f"DROP TRIGGER IF EXISTS {CAPTURE_FUNCTION}_{prefix}{i} ON {prefix}{i}")
+    for j in range(newpartitions):
+        cur.execute(f"DROP TABLE IF EXISTS shadow_{prefix}{j}")
+    cur.execute(f"DROP TABLE IF EXISTS {LOG_TABLE}")
+    openconnection.commit()
+
+
+def _index_specs(openconnection, prefix, oldpartitions):
+    # The shadows get the indexes the fragments they replace have.
+    specs = []
+    for i in range(oldpartitions):
+        for spec in get_fragment_indexes(f"{prefix}{i}", openconnection):
+            if spec not in specs:
+                specs.append(spec)
+    return specs
+
+
+def _rename_table(cur, oldname, newname):
+    # Fragment index names embed the table name (idx_<table>_<column>), so they
+    # move with it; otherwise a later fragment with the old name finds them taken.
+    cur.execute(f"ALTER TABLE {oldname} RENAME TO {newname}")
+    cur.execute("""
+        SELECT indexname FROM pg_catalog.pg_indexes
+        WHERE schemaname = 'public' AND tablename = %s
+    """, (newname,))
+    for (indexname,) in cur.fetchall():
+        if indexname.startswith(f"idx_{oldname}_"):
+            cur.execute(f"ALTER INDEX {indexname} RENAME TO idx_{newname}_{indexname[len(oldname) + 5:]}")
+
+
+def _swap(cur, prefix, oldpartitions, newpartitions, reused):
+    # Reused tables move aside first so that renames never collide.
+    for j, i in reused.items():
+        cur.execute(f"DROP TRIGGER IF EXISTS {CAPTURE_FUNCTION}_{prefix}{i} ON {prefix}{i}")
+        _rename_table(cur, f"{prefix}{i}", f"reused_{prefix}{j}")
+    for i in range(oldpartitions):
+        if i not in reused.values():
+            cur.execute(f"DROP TABLE {prefix}{i}")
+    for j in range(newpartitions):
+        source = f"reused_{prefix}{j}" if j in reused else f"shadow_{prefix}{j}"
+        _rename_table(cur, source, f"{prefix}{j}")
+    cur.execute(f"DROP TABLE {LOG_TABLE}")
+
+
+def _begin_swap(cur, scheme, prefix, oldpartitions, version):
+    # Slot sequence first: roundrobininsert holds it while writing a fragment,
+    # so taking it before the fragment locks cannot deadlock with writers.
+    if scheme == 'roundrobin':
+        lock_roundrobin_slots(cur)
+    lock_partition_metadata(cur, scheme)
+    # A layout change committed since the copy started replaced the fragments
+    # the shadows were built from; swapping now would drop its rows.
+    cur.execute("SELECT version FROM partition_metadata WHERE scheme = %s", (scheme,))
+    row = cur.fetchone()
+    if row is None or row[0] != version:
+        raise ValueError(f"The {scheme} layout changed during the repartition; nothing was swapped")
+    tables = ', '.join(f"{prefix}{i}" for i in range(oldpartitions))
+    cur.execute(f"LOCK TABLE {tables} IN EXCLUSIVE MODE")
+
+
+def _repartition_range(numberofpartitions, boundaries, openconnection):
+    cur = openconnection.cursor()
+    prefix = RANGE_TABLE_PREFIX
+
+    version, oldpartitions, oldboundaries = _current_layout('range', openconnection)
+    newboundaries = list(boundaries) if boundaries is not None else range_boundaries(numberofpartitions)
+    if len(newboundaries) != numberofpartitions:
+        raise ValueError("Expected one boundary per partition")
+    if newboundaries == list(oldboundaries):
+        return
+
+    reused, sources = plan_range_repartition(oldboundaries, newboundaries)
+    moved = sorted({i for feeding in sources.values() for i in feeding})
+    newintervals = _range_intervals(newboundaries)
+
+    _start_capture(openconnection, prefix, moved)
+    try:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        specs = _index_specs(openconnection, prefix, oldpartitions)
+        create_partitions(cur, f"shadow_{prefix}", numberofpartitions)
+        for j in reused:
+            cur.execute(f"DROP TABLE shadow_{prefix}{j}")
+        for j, feeding in sources.items():
+            for i in feeding:
+                cur.execute(f"""
+                    INSERT INTO shadow_{prefix}{j} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+                    SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME} FROM {prefix}{i}
+                    WHERE {_range_filter(newintervals[j])}
+                """)
+            finalize_table(f"shadow_{prefix}{j}", openconnection, setlogged=True)
+            for method, column in specs:
+                create_fragment_index(cur, f"shadow_{prefix}{j}", method, column)
+        cur.execute(f"DELETE FROM {LOG_TABLE}")
+        openconnection.commit()
+
+        _begin_swap(cur, 'range', prefix, oldpartitions, version)
+        for j in sources:
+            cur.execute(f"""
+                INSERT INTO shadow_{prefix}{j} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+                SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME} FROM {LOG_TABLE}
+                WHERE {_range_filter(newintervals[j])}
+                ORDER BY id
+            """)
+        _swap(cur, prefix, oldpartitions, numberofpartitions, reused)
+        save_partition_metadata(cur, 'range', numberofpartitions, boundaries=newboundaries)
+        openconnection.commit()
+    except Exception:
+        _cleanup(openconnection, prefix, oldpartitions, numberofpartitions)
+        raise
+
+
+def _numbered_rows(prefix, oldpartitions):
+    # Row s of the round-robin sequence sits in fragment s % N at position s // N,
+    # so position * N + fragment orders the rows by slot. Slots of rolled-back
+    # inserts are never filled, so the rows are renumbered densely from 0.
+    slots = ' UNION ALL '.join(f"""
+        SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME},
+               (ROW_NUMBER() OVER (ORDER BY ctid) - 1) * {oldpartitions} + {i} AS slot
+        FROM {prefix}{i}""" for i in range(oldpartitions))
+    return f"""
+        SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME}, ROW_NUMBER() OVER (ORDER BY slot) - 1 AS k
+        FROM ({slots}) AS slotted"""
+
+
+def _numbered_log(first):
+    # Rows inserted during the copy continue the sequence in insert order.
+    return f"""
+        SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME},
+               {first} + ROW_NUMBER() OVER (ORDER BY id) - 1 AS k
+        FROM {LOG_TABLE}"""
+
+
+def _repartition_roundrobin(numberofpartitions, openconnection):
+    cur = openconnection.cursor()
+    prefix = RROBIN_TABLE_PREFIX
+
+    version, oldpartitions, _ = _current_layout('roundrobin', openconnection)
+    if numberofpartitions == oldpartitions:
+        return
+
+    _start_capture(openconnection, prefix, range(oldpartitions))
+    try:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        specs = _index_specs(openconnection, prefix, oldpartitions)
+        create_partitions(cur, f"shadow_{prefix}", numberofpartitions)
+        copied = fanout_insert(cur, f"""
+            SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME}, k % {numberofpartitions} AS part
+            FROM ({_numbered_rows(prefix, oldpartitions)}) AS numbered
+            ORDER BY k
+        """, f"shadow_{prefix}", numberofpartitions)
+        for j in range(numberofpartitions):
+            finalize_table(f"shadow_{prefix}{j}", openconnection, setlogged=True)
+            for method, column in specs:
+                create_fragment_index(cur, f"shadow_{prefix}{j}", method, column)
+        cur.execute(f"DELETE FROM {LOG_TABLE}")
+        openconnection.commit()
+
+        _begin_swap(cur, 'roundrobin', prefix, oldpartitions, version)
+        replayed = fanout_insert(cur, f"""
+            SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME}, k % {numberofpartitions} AS part
+            FROM ({_numbered_log(copied)}) AS numbered
+            ORDER BY k
+        """, f"shadow_{prefix}", numberofpartitions)
+        _swap(cur, prefix, oldpartitions, numberofpartitions, {})
+        # Renumbered rows are dense, so the sequence continues right after them.
+        save_partition_metadata(cur, 'roundrobin', numberofpartitions, copied + replayed)
+        openconnection.commit()
+    except Exception:
+        _cleanup(openconnection, prefix, oldpartitions, numberofpartitions)
+        raise
+
+
+def repartition(scheme, numberofpartitions, openconnection, boundaries=None):
+    """
+    Move an existing range or round-robin layout to numberofpartitions fragments without taking it offline.
+    Readers keep using the old fragments until the final swap, and writers are only blocked while it runs.
+    Range partitions whose bounds do not change are kept as they are; only rows whose partition
+    changes are copied. Round-robin rows keep their global order, so inserts continue the same sequence.
+    :param scheme: 'range' or 'roundrobin'
+    :param boundaries: Upper bounds of the new range partitions; equal-width when omitted
+    """
+    if numberofpartitions <= 0:
+        raise ValueError("Number of partitions must be positive")
+    if scheme == 'range':
+        _repartition_range(numberofpartitions, boundaries, openconnection)
+    elif scheme == 'roundrobin':
+        _repartition_roundrobin(numberofpartitions, openconnection)
+    else:
+        raise ValueError(f"Unknown partitioning scheme: {scheme}")
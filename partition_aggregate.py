@@ -0,0 +1,147 @@
+#
+# Scatter-gather aggregation over the range and round-robin fragments.
+#
+# Every fragment computes partial COUNT/SUM/MIN/MAX per (group, rating bucket)
+# on its own pooled connection; the partials are merged here, so averages are
+# derived from the global sum and count rather than averaged per fragment.
+#
+
+from concurrent.futures import ThreadPoolExecutor
+
+from Group9_Assignment import pooled_connection
+from partition_query import build_predicate, partition_tables
+
+USER_ID_COLNAME = 'userid'
+MOVIE_ID_COLNAME = 'movieid'
+RATING_COLNAME = 'rating'
+
+GROUP_COLUMNS = {None: 'NULL', 'userid': USER_ID_COLNAME, 'movieid': MOVIE_ID_COLNAME}
+
+
+class RatingAggregate:
+    """
+    Mergeable COUNT/SUM/MIN/MAX of ratings plus a histogram keyed by bucket lower bound.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = {}
+
+    def add(self, bucket, count, total, minimum, maximum):
+        self.count += count
+        self.sum += total
+        self.min = minimum if self.min is None else min(self.min, minimum)
+        self.max = maximum if self.max is None else max(self.max, maximum)
+        if bucket is not None:
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + count
+
+    def merge(self, other):
+        for bucket, count in other.histogram.items():
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    @property
+    def avg(self):
+        return self.sum / self.count if self.count else None
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'avg': self.avg, 'min': self.min, 'max': self.max,
+                'histogram': dict(sorted(self.histogram.items()))}
+
+
+def _partial_aggregate(tablename, groupcolumn, predicate, params, bucketwidth):
+    if bucketwidth is None:
+        bucket, bucketparams = "NULL::float8", []
+    else:
+        bucket, bucketparams = f"floor({RATING_COLNAME} / %s) * %s", [bucketwidth, bucketwidth]
+    with pooled_connection() as con:
+        try:
+            cur = con.cursor()
+            cur.execute(f"""
+                SELECT {groupcolumn}, {bucket} AS bucket,
+                       COUNT(*), SUM({RATING_COLNAME}), MIN({RATING_COLNAME}), MAX({RATING_COLNAME})
+                FROM {tablename}{predicate}
+                GROUP BY 1, 2
+            """, bucketparams + list(params))
+            return cur.fetchall()
+        finally:
+            con.rollback()
+
+
+def aggregate_partitions(tables, groupby=None, predicate='', params=(), bucketwidth=0.5, workers=4):
+    """
+    Run the partial aggregate on every table in parallel and merge the results.
+    :param groupby: None, 'userid' or 'movieid'
+    :param bucketwidth: Width of the rating histogram buckets; None skips the histogram
+    :return: {group: RatingAggregate}; the only key is None when groupby is None
+    """
+    if groupby not in GROUP_COLUMNS:
+        raise ValueError(f"Cannot group by {groupby}")
+
+    merged = {}
+    if not tables:
+        return merged
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(tables))) as executor:
+        futures = [executor.submit(_partial_aggregate, tablename, GROUP_COLUMNS[groupby], predicate, params,
+                                   bucketwidth)
+                   for tablename in tables]
+        for future in futures:
+            for group, bucket, count, total, minimum, maximum in future.result():
+                if group not in merged:
+                    merged[group] = RatingAggregate()
+                merged[group].add(None if bucket is None else float(bucket), count, total, minimum, maximum)
+    return merged
+
+
+def aggregate_ratings(scheme='range', groupby=None, minrating=None, maxrating=None, userid=None, movieid=None,
+                      bucketwidth=0.5, workers=4):
+    """
+    COUNT/SUM/AVG/MIN/MAX and rating histogram over one partitioning scheme's fragments.
+    Range fragments outside [minrating, maxrating] are pruned before the scatter.
+    :param scheme: 'range' or 'roundrobin'
+    :param groupby: None for one global aggregate, or 'userid' / 'movieid'
+    :return: Aggregate dict when groupby is None, otherwise {group: aggregate dict}
+    """
+    with pooled_connection() as con:
+        tables = partition_tables(scheme, con, minrating, maxrating)
+        con.rollback()
+
+    predicate, params = build_predicate(minrating, maxrating, userid, movieid)
+    merged = aggregate_partitions(tables, groupby, predicate, params, bucketwidth, workers)
+
+    if groupby is None:
+        return merged.get(None, RatingAggregate()).as_dict()
+    return {group: aggregate.as_dict() for group, aggregate in merged.items()}
+
+
+def _partition_count(tablename):
+    with pooled_connection() as con:
+        try:
+            cur = con.cursor()
+            cur.execute(f"SELECT COUNT(*) FROM {tablename}")
+            return cur.fetchone()[0]
+        finally:
+            con.rollback()
+
+
+def partition_row_counts(scheme='range', workers=4):
+    """
+    Row count of every fragment of a scheme, counted in parallel.
+    :return: List of counts in partition order
+    """
+    with pooled_connection() as con:
+        tables = partition_tables(scheme, con)
+        con.rollback()
+
+    if not tables:
+        return []
+    with ThreadPoolExecutor(max_workers=min(workers, len(tables))) as executor:
+        return list(executor.map(_partition_count, tables))
@@ -0,0 +1,186 @@
+#
+# Read path over the range and round-robin fragments.
+#
+# Range queries only touch the range_part{i} tables whose boundaries overlap
+# the requested rating interval; round-robin fragments are all scanned, each
+# on its own pooled connection, and the rows are merged into one generator.
+#
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from Group9_Assignment import get_partition_count, get_partition_metadata, pooled_connection, range_boundaries
+
+RANGE_TABLE_PREFIX = 'range_part'
+RROBIN_TABLE_PREFIX = 'rrobin_part'
+USER_ID_COLNAME = 'userid'
+MOVIE_ID_COLNAME = 'movieid'
+RATING_COLNAME = 'rating'
+
+_DONE = object()
+
+
+def prune_range_partitions(boundaries, minrating=None, maxrating=None):
+    """
+    Indexes of the range partitions that can hold ratings in [minrating, maxrating].
+    Partition 0 covers [0, boundaries[0]], partition i covers (boundaries[i - 1], boundaries[i]].
+    :param boundaries: Upper boundary of every partition, in order
+    :return: List of partition indexes
+    """
+    selected = []
+    lower = None
+    for i, upper in enumerate(boundaries):
+        below = minrating is not None and upper < minrating
+        above = maxrating is not None and lower is not None and lower >= maxrating
+        if not below and not above:
+            selected.append(i)
+        lower = upper
+    return selected
+
+
+def _current_layout(scheme, openconnection):
+    # Read on every query: the per-connection cache is only invalidated on the
+    # connection that changed the layout, and pooled connections live long.
+    cur = openconnection.cursor()
+    cur.execute("SELECT to_regclass('partition_metadata') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return None
+    return get_partition_metadata(scheme, openconnection, refresh=True)
+
+
+def partition_tables(scheme, openconnection, minrating=None, maxrating=None):
+    """
+    Fragment tables of a partitioning scheme that can hold ratings in [minrating, maxrating].
+    Layouts created before partition metadata existed are found by table name.
+    :param scheme: 'range' or 'roundrobin'
+    :return: List of table names
+    """
+    if scheme not in ('range', 'roundrobin'):
+        raise ValueError(f"Unknown partitioning scheme: {scheme}")
+
+    metadata = _current_layout(scheme, openconnection)
+    if scheme == 'range':
+        if metadata is None:
+            numberofpartitions = get_partition_count(RANGE_TABLE_PREFIX, openconnection)
+            if numberofpartitions == 0:
+                return []
+            boundaries = range_boundaries(numberofpartitions)
+        else:
+            boundaries = metadata[2]
+        return [f"{RANGE_TABLE_PREFIX}{i}" for i in prune_range_partitions(boundaries, minrating, maxrating)]
+
+    if metadata is None:
+        numberofpartitions = get_partition_count(RROBIN_TABLE_PREFIX, openconnection)
+    else:
+        numberofpartitions = metadata[1]
+    return [f"{RROBIN_TABLE_PREFIX}{i}" for i in range(numberofpartitions)]
+
+
+def build_predicate(minrating=None, maxrating=None, userid=None, movieid=None):
+    """
+    WHERE clause and parameters shared by every fragment query.
+    :return: (sql, params); sql is empty when there is no predicate
+    """
+    clauses = []
+    params = []
+    if minrating is not None:
+        clauses.append(f"{RATING_COLNAME} >= %s")
+        params.append(minrating)
+    if maxrating is not None:
+        clauses.append(f"{RATING_COLNAME} <= %s")
+        params.append(maxrating)
+    if userid is not None:
+        clauses.append(f"{USER_ID_COLNAME} = %s")
+        params.append(userid)
+    if movieid is not None:
+        clauses.append(f"{MOVIE_ID_COLNAME} = %s")
+        params.append(movieid)
+    if not clauses:
+        return '', params
+    return ' WHERE ' + ' AND '.join(clauses), params
+
+
+def _put(results, item, stop):
+    while not stop.is_set():
+        try:
+            results.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _scan_partition(tablename, predicate, params, results, stop, fetchsize):
+    try:
+        with pooled_connection() as con:
+            try:
+                # A named cursor keeps the rows on the server and streams them in fetchsize batches.
+                with con.cursor(name=f"scan_{tablename}") as cur:
+                    cur.execute(f"""
+                        SELECT {USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME}
+                        FROM {tablename}{predicate}
+                    """, params)
+                    while not stop.is_set():
+                        rows = cur.fetchmany(fetchsize)
+                        if not rows:
+                            break
+                        _put(results, rows, stop)
+            finally:
+                con.rollback()
+    except Exception as e:
+        _put(results, e, stop)
+    finally:
+        _put(results, _DONE, stop)
+
+
+def scan_partitions(tables, predicate='', params=(), workers=4, fetchsize=10000):
+    """
+    Stream the rows matching predicate from every table, scanning up to workers tables concurrently.
+    Rows come back in no particular order.
+    :param tables: Fragment table names
+    :param predicate: WHERE clause from build_predicate
+    :return: Generator of (userid, movieid, rating)
+    """
+    if not tables:
+        return
+
+    results = queue.Queue(maxsize=workers * 4)
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=min(workers, len(tables)))
+    try:
+        for tablename in tables:
+            executor.submit(_scan_partition, tablename, predicate, params, results, stop, fetchsize)
+
+        remaining = len(tables)
+        while remaining:
+            item = results.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield from item
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def query_ratings(minrating=None, maxrating=None, userid=None, movieid=None, scheme='range',
+                  openconnection=None, workers=4, fetchsize=10000):
+    """
+    Ratings matching every given predicate, read from the fragments of one partitioning scheme.
+    :param minrating: Inclusive lower bound on rating
+    :param maxrating: Inclusive upper bound on rating
+    :param scheme: 'range' to prune range_part tables by boundary, 'roundrobin' to scan every rrobin_part table
+    :param openconnection: Used for the metadata lookup only; fragments are read on pooled connections
+    :return: Generator of (userid, movieid, rating)
+    """
+    if openconnection is None:
+        with pooled_connection() as con:
+            tables = partition_tables(scheme, con, minrating, maxrating)
+            con.rollback()
+    else:
+        tables = partition_tables(scheme, openconnection, minrating, maxrating)
+
+    predicate, params = build_predicate(minrating, maxrating, userid, movieid)
+    return scan_partitions(tables, predicate, params, workers, fetchsize)
@@ -0,0 +1,123 @@
+#
+# Per-movie and per-user rating summaries maintained on insert.
+#
+# movie_rating_summary and user_rating_summary keep COUNT, SUM and SUM of
+# squares of the ratings for every movieid / userid. They are built once from
+# the ratings table; afterwards a statement-level trigger on that table folds
+# every INSERT or COPY into them in the inserting transaction, so rangeinsert,
+# roundrobininsert, the batched inserts and incremental loads all keep them
+# current. Averages and variances are then one primary-key lookup.
+#
+
+RATING_COLNAME = 'rating'
+USER_ID_COLNAME = 'userid'
+MOVIE_ID_COLNAME = 'movieid'
+
+SUMMARY_TABLES = {'movieid': 'movie_rating_summary', 'userid': 'user_rating_summary'}
+MAINTAIN_FUNCTION = 'maintain_rating_summaries'
+
+
+def _summary_upsert(summarytable, keycolumn, source):
+    # Sorted input makes concurrent writers lock summary rows in the same
+    # order, so overlapping batches queue up instead of deadlocking.
+    return f"""
+        INSERT INTO {summarytable} ({keycolumn}, count, sum, sumsq)
+        SELECT {keycolumn}, COUNT(*), SUM({RATING_COLNAME}), SUM({RATING_COLNAME} * {RATING_COLNAME})
+        FROM {source}
+        GROUP BY {keycolumn}
+        ORDER BY {keycolumn}
+        ON CONFLICT ({keycolumn}) DO UPDATE
+        SET count = {summarytable}.count + EXCLUDED.count,
+            sum = {summarytable}.sum + EXCLUDED.sum,
+            sumsq = {summarytable}.sumsq + EXCLUDED.sumsq
+    """
+
+
+def build_rating_summaries(ratingstablename, openconnection):
+    """
+    (Re)build both summary tables from ratingstablename and install the trigger that maintains them.
+    Inserts into ratingstablename wait while this runs. Rerun it after the ratings table is dropped
+    and recreated (e.g. by snapshot.restore), which also drops the trigger.
+    """
+    cur = openconnection.cursor()
+
+    try:
+        cur.execute(f"LOCK TABLE {ratingstablename} IN SHARE MODE")
+        for keycolumn, summarytable in SUMMARY_TABLES.items():
+            cur.execute(f"DROP TABLE IF EXISTS {summarytable}")
+            cur.execute(f"""
+                CREATE TABLE {summarytable} (
+                    {keycolumn} INTEGER PRIMARY KEY,
+                    count BIGINT NOT NULL,
+                    sum FLOAT8 NOT NULL,
+                    sumsq FLOAT8 NOT NULL
+                )
+            """)
+            cur.execute(f"""
+                INSERT INTO {summarytable} ({keycolumn}, count, sum, sumsq)
+                SELECT {keycolumn}, COUNT(*), SUM({RATING_COLNAME}), SUM({RATING_COLNAME} * {RATING_COLNAME})
+                FROM {ratingstablename}
+                GROUP BY {keycolumn}
+            """)
+            cur.execute(f"ANALYZE {summarytable}")
+
+        cur.execute(f"""
+            CREATE OR REPLACE FUNCTION {MAINTAIN_FUNCTION}() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                {';'.join(_summary_upsert(summarytable, keycolumn, 'inserted')
+                          for keycolumn, summarytable in SUMMARY_TABLES.items())};
+                RETURN NULL;
+            END
+            $$
+        """)
+        cur.execute(f"DROP TRIGGER IF EXISTS {MAINTAIN_FUNCTION}_{ratingstablename} ON {ratingstablename}")
+        cur.execute(f"""
+            CREATE TRIGGER {MAINTAIN_FUNCTION}_{ratingstablename} AFTER INSERT ON {ratingstablename}
+            REFERENCING NEW TABLE AS inserted
+            FOR EACH STATEMENT EXECUTE PROCEDURE {MAINTAIN_FUNCTION}()
+        """)
+        openconnection.commit()
+    except Exception:
+        openconnection.rollback()
+        raise
+
+
+def drop_rating_summaries(ratingstablename, openconnection):
+    cur = openconnection.cursor()
+    cur.execute(f"DROP TRIGGER IF EXISTS {MAINTAIN_FUNCTION}_{ratingstablename} ON {ratingstablename}")
+    for summarytable in SUMMARY_TABLES.values():
+        cur.execute(f"DROP TABLE IF EXISTS {summarytable}")
+    openconnection.commit()
+
+
+def _stats(count, total, sumsq):
+    if not count:
+        return {'count': 0, 'avg': None, 'variance': None, 'stddev': None}
+    avg = total / count
+    # Population variance; clamped because E[x^2] - E[x]^2 can round just below zero.
+    variance = max(sumsq / count - avg * avg, 0.0)
+    return {'count': count, 'avg': avg, 'variance': variance, 'stddev': variance ** 0.5}
+
+
+def _rating_stats(keycolumn, key, openconnection):
+    cur = openconnection.cursor()
+    cur.execute(f"""
+        SELECT count, sum, sumsq FROM {SUMMARY_TABLES[keycolumn]}
+        WHERE {keycolumn} = %s
+    """, (key,))
+    row = cur.fetchone()
+    return _stats(*row) if row is not None else _stats(0, 0.0, 0.0)
+
+
+def movie_rating_stats(movieid, openconnection):
+    """
+    :return: dict with count, avg, variance and stddev of the movie's ratings
+    """
+    return _rating_stats(MOVIE_ID_COLNAME, movieid, openconnection)
+
+
+def user_rating_stats(userid, openconnection):
+    """
+    :return: dict with count, avg, variance and stddev of the user's ratings
+    """
+    return _rating_stats(USER_ID_COLNAME, userid, openconnection)
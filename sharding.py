@@ -0,0 +1,398 @@
+#
+# Multi-node sharding of the range and round-robin fragments.
+#
+# A ShardMap places every range_part{i} / rrobin_part{i} table on a
+# PostgreSQL instance (DSN). The master ratings table and partition_metadata
+# stay on the coordinator, i.e. the database behind openconnection.
+#
+# Partitioning reads ratings once on the coordinator and streams each routed
+# row to its node, all fragments in parallel. The master write and the
+# fragment write of an insert are kept consistent with two-phase commit,
+# which needs max_prepared_transactions > 0 on every instance.
+#
+# Trying it locally with several instances on different ports:
+#
+#   shardmap = ShardMap.local(RANGE_TABLE_PREFIX, 5, [5433, 5434, 5435])
+#   sharding.rangepartition('ratings', 5, conn, shardmap)
+#   sharding.rangeinsert('ratings', 100, 2, 3, conn)
+#
+
+import bisect
+import queue
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import psycopg2.errors
+
+from Group9_Assignment import (COPY_CHUNK_SIZE, ROUNDROBIN_SLOT_SEQUENCE, equidepth_boundaries, get_partition_metadata,
+                               lock_partition_metadata, lock_roundrobin_slots, range_boundaries, range_routing_query,
+                               roundrobin_routing_query, save_partition_metadata, validate_rating)
+
+RANGE_TABLE_PREFIX = 'range_part'
+RROBIN_TABLE_PREFIX = 'rrobin_part'
+USER_ID_COLNAME = 'userid'
+MOVIE_ID_COLNAME = 'movieid'
+RATING_COLNAME = 'rating'
+
+SHARD_MAP_TABLE = 'shard_map'
+
+# dsn -> open connection to that node, reused by the insert functions
+_node_connections = {}
+
+# coordinator connection -> {prefix: (metadata version it was loaded for, ShardMap)}
+_shard_map_cache = weakref.WeakKeyDictionary()
+
+
+class ShardMap:
+    """
+    Placement of fragment tables on PostgreSQL instances.
+    """
+
+    def __init__(self, placements):
+        """
+        :param placements: {fragment table name: DSN of the node holding it}
+        """
+        self.placements = dict(placements)
+
+    @classmethod
+    def assign(cls, prefix, numberofpartitions, dsns):
+        """
+        Spread prefix0 .. prefix{N-1} over the given DSNs in turn.
+        """
+        return cls({f"{prefix}{i}": dsns[i % len(dsns)] for i in range(numberofpartitions)})
+
+    @classmethod
+    def local(cls, prefix, numberofpartitions, ports, dbname='movie_rating', user='postgres', password='1234',
+              host='localhost'):
+        """
+        Shard map over several instances on one host, one per port.
+        """
+        dsns = [f"host='{host}' port={port} dbname='{dbname}' user='{user}' password='{password}'" for port in ports]
+        return cls.assign(prefix, numberofpartitions, dsns)
+
+    def dsn(self, tablename):
+        return self.placements[tablename]
+
+    def save(self, prefix, openconnection):
+        cur = openconnection.cursor()
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {SHARD_MAP_TABLE} (
+                tablename TEXT PRIMARY KEY,
+                dsn TEXT NOT NULL
+            )
+        """)
+        cur.execute(f"DELETE FROM {SHARD_MAP_TABLE} WHERE tablename ~ %s", (f'^{prefix}[0-9]+$',))
+        for tablename, dsn in self.placements.items():
+            cur.execute(f"INSERT INTO {SHARD_MAP_TABLE} (tablename, dsn) VALUES (%s, %s)", (tablename, dsn))
+        # Saved in the same transaction as the partition metadata, so it belongs to that version.
+        cur.execute("SELECT txid_current()")
+        _shard_map_cache.setdefault(openconnection, {})[prefix] = (cur.fetchone()[0], self)
+
+    @classmethod
+    def load(cls, prefix, openconnection, version=None, refresh=False):
+        """
+        :param version: Partition metadata version the caller routes with; a map cached for
+                        another version is read again, since a re-shard replaces both together
+        """
+        cache = _shard_map_cache.setdefault(openconnection, {})
+        cached = cache.get(prefix)
+        if refresh or cached is None or (version is not None and cached[0] != version):
+            cur = openconnection.cursor()
+            cur.execute(f"SELECT tablename, dsn FROM {SHARD_MAP_TABLE} WHERE tablename ~ %s",
+                        (f'^{prefix}[0-9]+$',))
+            cached = cache[prefix] = (version, cls(cur.fetchall()))
+        return cached[1]
+
+
+class _QueueReader:
+    # COPY FROM STDIN source fed by the routing thread; None ends the stream.
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.done = False
+
+    def read(self, size=-1):
+        chunk = self.chunks.get()
+        if chunk is None:
+            self.done = True
+            return b''
+        return chunk
+
+
+class _RoutingWriter:
+    # COPY TO STDOUT target: splits "userid\tmovieid\trating\tpart" rows into
+    # per-partition chunks of plain "userid\tmovieid\trating" rows.
+    def __init__(self, queues, flushsize=COPY_CHUNK_SIZE):
+        self.queues = queues
+        self.flushsize = flushsize
+        self.buffers = [[] for _ in queues]
+        self.sizes = [0] * len(queues)
+        self.rows = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        for line in data.splitlines():
+            row, _, part = line.rpartition(b'\t')
+            i = int(part)
+            self.buffers[i].append(row)
+            self.sizes[i] += len(row) + 1
+            self.rows += 1
+            if self.sizes[i] >= self.flushsize:
+                self._flush(i)
+
+    def _flush(self, i):
+        if self.buffers[i]:
+            self.queues[i].put(b'\n'.join(self.buffers[i]) + b'\n')
+            self.buffers[i] = []
+            self.sizes[i] = 0
+
+    def close(self):
+        for i, chunks in enumerate(self.queues):
+            self._flush(i)
+            chunks.put(None)
+
+
+def _xid(con, gtrid, branch):
+    return con.xid(0, gtrid, branch)
+
+
+def _rollback_all(connections):
+    for con in connections:
+        try:
+            con.tpc_rollback()
+        except psycopg2.Error:
+            pass
+
+
+def _load_fragment(con, tablename, chunks, xid):
+    reader = _QueueReader(chunks)
+    try:
+        con.tpc_begin(xid)
+        cur = con.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {tablename}")
+        cur.execute(f"""
+            CREATE TABLE {tablename} (
+                {USER_ID_COLNAME} INTEGER,
+                {MOVIE_ID_COLNAME} INTEGER,
+                {RATING_COLNAME} FLOAT
+            )
+        """)
+        cur.copy_expert(f"COPY {tablename} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME}) FROM STDIN",
+                        reader, size=COPY_CHUNK_SIZE)
+        cur.execute(f"ANALYZE {tablename}")
+        con.tpc_prepare()
+    except Exception:
+        # Keep consuming so the routing thread never blocks on this queue.
+        while not reader.done and chunks.get() is not None:
+            pass
+        raise
+
+
+def _distribute(routedquery, prefix, numberofpartitions, openconnection, shardmap):
+    """
+    Stream the rows of routedquery from the coordinator to the node owning each fragment.
+    On return every node holds a prepared (not yet committed) transaction that loaded its fragment.
+    :return: (node connections in partition order, number of rows routed)
+    """
+    gtrid = uuid.uuid4().hex
+    queues = [queue.Queue(maxsize=8) for _ in range(numberofpartitions)]
+    connections = []
+    try:
+        for i in range(numberofpartitions):
+            connections.append(psycopg2.connect(shardmap.dsn(f"{prefix}{i}")))
+
+        # Every fragment loader must run at once: the router feeds all of them.
+        with ThreadPoolExecutor(max_workers=numberofpartitions) as executor:
+            futures = [executor.submit(_load_fragment, con, f"{prefix}{i}", queues[i], _xid(con, gtrid, str(i)))
+                       for i, con in enumerate(connections)]
+            writer = _RoutingWriter(queues)
+            try:
+                openconnection.cursor().copy_expert(f"COPY ({routedquery}) TO STDOUT", writer)
+            finally:
+                writer.close()
+            for future in futures:
+                future.result()
+    except Exception:
+        _rollback_all(connections)
+        for con in connections:
+            con.close()
+        raise
+    return connections, writer.rows
+
+
+def _drop_unplaced(prefix, oldmap, newmap):
+    for tablename, dsn in oldmap.placements.items():
+        if newmap.placements.get(tablename) == dsn:
+            continue
+        con = psycopg2.connect(dsn)
+        try:
+            con.cursor().execute(f"DROP TABLE IF EXISTS {tablename}")
+            con.commit()
+        finally:
+            con.close()
+
+
+def _shard(scheme, prefix, routedquery, numberofpartitions, openconnection, shardmap, boundaries=None):
+    cur = openconnection.cursor()
+    try:
+        # Same lock order as Group9_Assignment's partitioning, held until the
+        # coordinator commit: inserters finish before any node drops a fragment,
+        # and later ones wait and then see the new layout version.
+        if scheme == 'roundrobin':
+            lock_roundrobin_slots(cur)
+        lock_partition_metadata(cur, scheme)
+        cur.execute("SELECT to_regclass(%s)", (SHARD_MAP_TABLE,))
+        if cur.fetchone()[0] is None:
+            oldmap = ShardMap({})
+        else:
+            oldmap = ShardMap.load(prefix, openconnection, refresh=True)
+
+        connections, rows = _distribute(routedquery, prefix, numberofpartitions, openconnection, shardmap)
+    except Exception:
+        openconnection.rollback()
+        raise
+
+    try:
+        nextrow = rows if scheme == 'roundrobin' else 0
+        save_partition_metadata(cur, scheme, numberofpartitions, nextrow, boundaries)
+        shardmap.save(prefix, openconnection)
+        # The coordinator commit is the decision point of the two-phase commit:
+        # a node that fails after it keeps its prepared transaction, which
+        # tpc_recover() on that node lists for manual completion.
+        openconnection.commit()
+    except Exception:
+        openconnection.rollback()
+        _rollback_all(connections)
+        for con in connections:
+            con.close()
+        raise
+
+    for con in connections:
+        con.tpc_commit()
+        con.close()
+    _drop_unplaced(prefix, oldmap, shardmap)
+
+
+def rangepartition(ratingstablename, numberofpartitions, openconnection, shardmap, equidepth=False):
+    if numberofpartitions <= 0:
+        raise ValueError("Number of partitions must be positive")
+
+    if equidepth:
+        boundaries = equidepth_boundaries(ratingstablename, numberofpartitions, openconnection)
+    else:
+        boundaries = range_boundaries(numberofpartitions)
+
+    _shard('range', RANGE_TABLE_PREFIX, range_routing_query(ratingstablename, boundaries), numberofpartitions,
+           openconnection, shardmap, boundaries=boundaries)
+
+
+def roundrobinpartition(ratingstablename, numberofpartitions, openconnection, shardmap):
+    if numberofpartitions <= 0:
+        raise ValueError("Number of partitions must be positive")
+
+    _shard('roundrobin', RROBIN_TABLE_PREFIX, roundrobin_routing_query(ratingstablename, numberofpartitions),
+           numberofpartitions, openconnection, shardmap)
+
+
+def _node_connection(dsn):
+    con = _node_connections.get(dsn)
+    if con is None or con.closed:
+        con = _node_connections[dsn] = psycopg2.connect(dsn)
+    return con
+
+
+def _insert_two_phase(coordinator, route, ratingstablename, userid, movieid, rating):
+    """
+    Insert into the master table on the coordinator and into the routed fragment on its node, atomically.
+    :param route: Called with a coordinator cursor inside the distributed transaction; returns the
+                  fragment table name and the DSN of its node, or None if the cached layout is stale
+    :return: False if route reported a stale layout and nothing was written
+    """
+    gtrid = uuid.uuid4().hex
+    coordinator.tpc_begin(_xid(coordinator, gtrid, 'coordinator'))
+    participants = [coordinator]
+    try:
+        cur = coordinator.cursor()
+        routed = route(cur)
+        if routed is None:
+            coordinator.tpc_rollback()
+            return False
+        tablename, dsn = routed
+
+        cur.execute(f"""
+            INSERT INTO {ratingstablename} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+            VALUES (%s, %s, %s)
+        """, (userid, movieid, rating))
+
+        node = _node_connection(dsn)
+        node.tpc_begin(_xid(node, gtrid, tablename))
+        participants.append(node)
+        node.cursor().execute(f"""
+            INSERT INTO {tablename} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME})
+            VALUES (%s, %s, %s)
+        """, (userid, movieid, rating))
+
+        for con in participants:
+            con.tpc_prepare()
+    except Exception:
+        _rollback_all(participants)
+        raise
+
+    for con in participants:
+        con.tpc_commit()
+    return True
+
+
+def _placements(prefix, openconnection, shardmap, version):
+    # An explicit shard map wins; otherwise use the one saved with this layout version.
+    return shardmap if shardmap is not None else ShardMap.load(prefix, openconnection, version)
+
+
+def rangeinsert(ratingstablename, userid, movieid, rating, openconnection, shardmap=None):
+    rating = validate_rating(rating)
+
+    refresh = False
+    while True:
+        try:
+            metadata = get_partition_metadata('range', openconnection, refresh)
+        except psycopg2.errors.UndefinedTable:
+            metadata = None
+        # tpc_begin needs an idle connection.
+        openconnection.rollback()
+        if metadata is None:
+            raise ValueError("Range partitions have not been created")
+        version, _, boundaries = metadata
+
+        def route(cur):
+            cur.execute("SELECT version FROM partition_metadata WHERE scheme = 'range' FOR SHARE")
+            row = cur.fetchone()
+            if row is None or row[0] != version:
+                return None
+            tablename = f"{RANGE_TABLE_PREFIX}{bisect.bisect_left(boundaries, rating)}"
+            return tablename, _placements(RANGE_TABLE_PREFIX, openconnection, shardmap, version).dsn(tablename)
+
+        if _insert_two_phase(openconnection, route, ratingstablename, userid, movieid, rating):
+            return
+        refresh = True
+
+
+def roundrobininsert(ratingstablename, userid, itemid, rating, openconnection, shardmap=None):
+    rating = validate_rating(rating)
+    openconnection.commit()
+
+    def route(cur):
+        # Same slot sequence as Group9_Assignment.roundrobininsert, claimed inside the distributed transaction.
+        cur.execute(f"SELECT nextval('{ROUNDROBIN_SLOT_SEQUENCE}')")
+        row_number = cur.fetchone()[0]
+        # The row lock keeps a re-shard from replacing the shard map until this insert is done.
+        cur.execute("SELECT partitions, version FROM partition_metadata WHERE scheme = 'roundrobin' FOR SHARE")
+        slot = cur.fetchone()
+        if slot is None:
+            raise ValueError("Round robin partitions have not been created")
+        num_partitions, version = slot
+        tablename = f"{RROBIN_TABLE_PREFIX}{row_number % num_partitions}"
+        return tablename, _placements(RROBIN_TABLE_PREFIX, openconnection, shardmap, version).dsn(tablename)
+
+    _insert_two_phase(openconnection, route, ratingstablename, userid, itemid, rating)
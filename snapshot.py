@@ -0,0 +1,201 @@
+#
+# Binary snapshot and restore of the ratings table and its fragments.
+#
+# Every table is written with COPY ... (FORMAT binary), gzip-compressed by
+# default, next to a manifest.json holding row counts and the partition
+# metadata. All tables are exported in parallel from one exported snapshot,
+# so the files are consistent with each other. Restore recreates the tables
+# and COPYs every file back in parallel. Every worker opens its own
+# connection to the same server and database as openconnection.
+#
+
+import datetime
+import gzip
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from Group9_Assignment import (COPY_CHUNK_SIZE, connection_params, create_partitions, drop_partitions,
+                               finalize_table, getopenconnection, save_partition_metadata)
+
+RANGE_TABLE_PREFIX = 'range_part'
+RROBIN_TABLE_PREFIX = 'rrobin_part'
+USER_ID_COLNAME = 'userid'
+MOVIE_ID_COLNAME = 'movieid'
+RATING_COLNAME = 'rating'
+
+MANIFEST_NAME = 'manifest.json'
+SNAPSHOT_FORMAT = 'pgcopy-binary'
+SCHEMES = {'range': RANGE_TABLE_PREFIX, 'roundrobin': RROBIN_TABLE_PREFIX}
+
+
+def _open(path, mode, compression):
+    if compression == 'gzip':
+        # Level 1: the fixed-width binary rows compress well even at the fastest setting.
+        return gzip.open(path, mode, compresslevel=1)
+    if compression is None:
+        return open(path, mode)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def _copy_sql(tablename, direction):
+    return (f"COPY {tablename} ({USER_ID_COLNAME}, {MOVIE_ID_COLNAME}, {RATING_COLNAME}) "
+            f"{direction} (FORMAT binary)")
+
+
+def _fragments(cur, prefix):
+    cur.execute("""
+        SELECT tablename FROM pg_catalog.pg_tables
+        WHERE schemaname = 'public' AND tablename ~ %s
+    """, (f'^{prefix}[0-9]+$',))
+    return sorted((tablename for (tablename,) in cur.fetchall()), key=lambda name: int(name[len(prefix):]))
+
+
+def _export_table(tablename, path, snapshotid, compression, connectionparams):
+    con = getopenconnection(**connectionparams)
+    try:
+        cur = con.cursor()
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshotid,))
+        with _open(path, 'wb', compression) as output:
+            cur.copy_expert(_copy_sql(tablename, 'TO STDOUT'), output, size=COPY_CHUNK_SIZE)
+        return cur.rowcount
+    finally:
+        con.close()
+
+
+def snapshot(directory, openconnection, ratingstablename='ratings', compression='gzip', workers=4,
+             connectionparams=None):
+    """
+    Write ratingstablename and every range_part / rrobin_part fragment to directory.
+    :param compression: 'gzip' or None
+    :param connectionparams: getopenconnection arguments for the workers; taken from openconnection when omitted
+    :return: The manifest dict that was written to directory/manifest.json
+    """
+    if connectionparams is None:
+        connectionparams = connection_params(openconnection)
+    os.makedirs(directory, exist_ok=True)
+    cur = openconnection.cursor()
+    suffix = '.bin.gz' if compression == 'gzip' else '.bin'
+
+    try:
+        # The exporting transaction stays open until every worker has imported its snapshot.
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cur.execute("SELECT pg_export_snapshot()")
+        snapshotid = cur.fetchone()[0]
+
+        tables = [(ratingstablename, None)]
+        for scheme, prefix in SCHEMES.items():
+            tables += [(tablename, scheme) for tablename in _fragments(cur, prefix)]
+
+        cur.execute("SELECT to_regclass('partition_metadata') IS NOT NULL")
+        metadata = {}
+        if cur.fetchone()[0]:
+            cur.execute("SELECT scheme, partitions, boundaries FROM partition_metadata")
+            metadata = {scheme: {'partitions': partitions, 'boundaries': boundaries}
+                        for scheme, partitions, boundaries in cur.fetchall() if scheme in SCHEMES}
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tables)))) as executor:
+            futures = [executor.submit(_export_table, tablename, os.path.join(directory, tablename + suffix),
+                                       snapshotid, compression, connectionparams)
+                       for tablename, _ in tables]
+            rows = [future.result() for future in futures]
+    finally:
+        openconnection.rollback()
+
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'compression': compression,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'ratings': ratingstablename,
+        'tables': [{'name': tablename, 'scheme': scheme, 'file': tablename + suffix, 'rows': count,
+                    'bytes': os.path.getsize(os.path.join(directory, tablename + suffix))}
+                   for (tablename, scheme), count in zip(tables, rows)],
+        'partition_metadata': metadata,
+    }
+    with open(os.path.join(directory, MANIFEST_NAME), 'w') as output:
+        json.dump(manifest, output, indent=2)
+    return manifest
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME)) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"{directory} is not a {SNAPSHOT_FORMAT} snapshot")
+    return manifest
+
+
+def _restore_table(entry, directory, compression, indexcolumns, connectionparams):
+    con = getopenconnection(**connectionparams)
+    try:
+        cur = con.cursor()
+        with _open(os.path.join(directory, entry['file']), 'rb', compression) as source:
+            cur.copy_expert(_copy_sql(entry['name'], 'FROM STDIN'), source, size=COPY_CHUNK_SIZE)
+        rows = cur.rowcount
+        finalize_table(entry['name'], con, indexcolumns=indexcolumns, setlogged=True)
+        con.commit()
+        return rows
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        con.close()
+
+
+def restore(directory, openconnection, workers=4, connectionparams=None):
+    """
+    Recreate the ratings table and fragments from a snapshot, replacing the current ones.
+    Tables are created first and then filled in parallel, so the restore is not one atomic
+    transaction; the partition metadata is written last.
+    :param connectionparams: getopenconnection arguments for the workers; taken from openconnection when omitted
+    :return: Rows restored per table
+    """
+    if connectionparams is None:
+        connectionparams = connection_params(openconnection)
+    manifest = read_manifest(directory)
+    ratingstablename = manifest['ratings']
+    cur = openconnection.cursor()
+
+    try:
+        cur.execute(f"DROP TABLE IF EXISTS {ratingstablename}")
+        cur.execute(f"""
+            CREATE UNLOGGED TABLE {ratingstablename} (
+                {USER_ID_COLNAME} INTEGER,
+                {MOVIE_ID_COLNAME} INTEGER,
+                {RATING_COLNAME} FLOAT
+            )
+        """)
+        for scheme, prefix in SCHEMES.items():
+            drop_partitions(cur, prefix)
+            count = sum(1 for entry in manifest['tables'] if entry['scheme'] == scheme)
+            create_partitions(cur, prefix, count)
+        openconnection.commit()
+    except Exception:
+        openconnection.rollback()
+        raise
+
+    entries = manifest['tables']
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(entries)))) as executor:
+        futures = [executor.submit(_restore_table, entry, directory, manifest['compression'],
+                                   [RATING_COLNAME] if entry['scheme'] is None else [], connectionparams)
+                   for entry in entries]
+        restored = {entry['name']: future.result() for entry, future in zip(entries, futures)}
+
+    for entry in entries:
+        if restored[entry['name']] != entry['rows']:
+            raise ValueError(f"Restored {restored[entry['name']]} rows into {entry['name']}, "
+                             f"snapshot has {entry['rows']}")
+
+    try:
+        for scheme, layout in manifest['partition_metadata'].items():
+            # Round-robin slots continue right after the restored rows.
+            nextrow = sum(entry['rows'] for entry in entries if entry['scheme'] == scheme)
+            save_partition_metadata(cur, scheme, layout['partitions'],
+                                    nextrow if scheme == 'roundrobin' else 0, layout['boundaries'])
+        openconnection.commit()
+    except Exception:
+        openconnection.rollback()
+        raise
+
+    return restored
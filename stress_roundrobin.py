@@ -0,0 +1,103 @@
+#
+# Stress test for roundrobininsert under many concurrent writers.
+#
+# Every writer is a separate process with its own connection. All of them
+# start together, insert their rows one roundrobininsert call at a time, and
+# the fragments are then checked: no row lost or duplicated, and no fragment
+# more than one row larger than any other.
+#
+# Usage: python stress_roundrobin.py [--writers 32] [--inserts 1000] [--partitions 5] [--batchsize 0]
+#
+
+DATABASE_NAME = 'stress_roundrobin'
+
+RATINGS_TABLE = 'ratings'
+RROBIN_TABLE_PREFIX = 'rrobin_part'
+
+import argparse
+import multiprocessing
+import sys
+import time
+
+import Group9_Assignment as Assignment
+
+
+def writer(writerid, inserts, batchsize, barrier):
+    con = Assignment.getopenconnection(dbname=DATABASE_NAME)
+    try:
+        rows = [(writerid, itemid, (itemid % 11) * 0.5) for itemid in range(inserts)]
+        barrier.wait()
+        if batchsize:
+            Assignment.roundrobininsert_many(RATINGS_TABLE, rows, con, batchsize)
+        else:
+            for userid, itemid, rating in rows:
+                Assignment.roundrobininsert(RATINGS_TABLE, userid, itemid, rating, con)
+    finally:
+        con.close()
+
+
+def fragment_counts(numberofpartitions, openconnection):
+    cur = openconnection.cursor()
+    counts = []
+    for i in range(numberofpartitions):
+        cur.execute(f"SELECT COUNT(*) FROM {RROBIN_TABLE_PREFIX}{i}")
+        counts.append(cur.fetchone()[0])
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Concurrent roundrobininsert stress test')
+    parser.add_argument('--writers', type=int, default=32)
+    parser.add_argument('--inserts', type=int, default=1000, help='rows per writer')
+    parser.add_argument('--partitions', type=int, default=5)
+    parser.add_argument('--batchsize', type=int, default=0, help='use roundrobininsert_many with this batch size')
+    args = parser.parse_args()
+
+    Assignment.create_db(DATABASE_NAME)
+    conn = Assignment.getopenconnection(dbname=DATABASE_NAME)
+    cur = conn.cursor()
+    cur.execute(f"DROP TABLE IF EXISTS {RATINGS_TABLE}")
+    cur.execute(f"CREATE TABLE {RATINGS_TABLE} (userid INTEGER, movieid INTEGER, rating FLOAT)")
+    conn.commit()
+    Assignment.roundrobinpartition(RATINGS_TABLE, args.partitions, conn)
+
+    barrier = multiprocessing.Barrier(args.writers + 1)
+    processes = [multiprocessing.Process(target=writer, args=(i, args.inserts, args.batchsize, barrier))
+                 for i in range(args.writers)]
+    for process in processes:
+        process.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    expected = args.writers * args.inserts
+    counts = fragment_counts(args.partitions, conn)
+    cur.execute(f"SELECT COUNT(*) FROM {RATINGS_TABLE}")
+    total = cur.fetchone()[0]
+    fragments = ' UNION ALL '.join(f"SELECT userid, movieid FROM {RROBIN_TABLE_PREFIX}{i}"
+                                   for i in range(args.partitions))
+    # (writer, item) is unique per inserted row, so duplicates would show up here.
+    cur.execute(f"SELECT COUNT(*) FROM (SELECT DISTINCT userid, movieid FROM ({fragments}) AS fragment_rows) AS keys")
+    distinct = cur.fetchone()[0]
+    conn.close()
+
+    print(f"{args.writers} writers x {args.inserts} rows in {elapsed:.2f}s ({expected / elapsed:.0f} rows/sec)")
+    print(f"fragment sizes: {counts} (spread {max(counts) - min(counts)})")
+
+    failures = []
+    if any(process.exitcode != 0 for process in processes):
+        failures.append("a writer process failed")
+    if total != expected:
+        failures.append(f"{total} rows in {RATINGS_TABLE}, expected {expected}")
+    if sum(counts) != expected or distinct != expected:
+        failures.append(f"{sum(counts)} fragment rows ({distinct} distinct), expected {expected}")
+    if max(counts) - min(counts) > 1:
+        failures.append("fragments differ by more than one row")
+
+    for failure in failures:
+        print("FAIL: " + failure)
+    if not failures:
+        print("PASS")
+    sys.exit(1 if failures else 0)
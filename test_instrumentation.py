@@ -0,0 +1,70 @@
+#
+# Unit tests for the instrumentation registry; no database needed.
+#
+
+import json
+
+import pytest
+
+import instrumentation
+
+
+@pytest.fixture(autouse=True)
+def disabled():
+    instrumentation.disable()
+    yield
+    instrumentation.disable()
+
+
+def test_statement_name_folds_numbers_and_parameters():
+    assert instrumentation.statement_name("INSERT INTO range_part12 (userid) VALUES (1)") == 'INSERT INTO range_part#'
+    assert instrumentation.statement_name(b"EXECUTE insert_rrobin_part3 (1, 2, 3)") == 'EXECUTE insert_rrobin_part#'
+    assert instrumentation.statement_name("\n  SELECT COUNT(*) FROM ratings") == 'SELECT COUNT FROM'
+
+
+def test_hooks_are_no_ops_until_enabled():
+    with instrumentation.phase('load'):
+        pass
+    instrumentation.count('rows', 5)
+    assert instrumentation.metrics() is None
+    assert not instrumentation.explain_enabled()
+
+
+def test_enabled_registry_collects_phases_and_counters():
+    metrics = instrumentation.enable(explain=True)
+    seen = []
+    metrics.add_listener(lambda kind, name, value: seen.append((kind, name)))
+
+    with instrumentation.phase('load'):
+        pass
+    instrumentation.observe_phase('load', 2.0)
+    instrumentation.count('rows', 5)
+    instrumentation.count('rows')
+
+    document = json.loads(metrics.to_json())
+    assert document['phases']['load']['calls'] == 2
+    assert document['phases']['load']['max_seconds'] == 2.0
+    assert document['counters'] == {'rows': 6}
+    assert seen == [('phase', 'load'), ('phase', 'load'), ('counter', 'rows'), ('counter', 'rows')]
+    assert instrumentation.explain_enabled()
+
+    metrics.reset()
+    assert metrics.as_dict()['counters'] == {}
+
+
+def test_prometheus_export_escapes_labels():
+    metrics = instrumentation.Metrics()
+    metrics.count('fanout "range"', 3)
+    metrics.observe_statement('SELECT COUNT FROM', 0.5)
+    text = metrics.to_prometheus()
+    assert '# TYPE group9_events_total counter' in text
+    assert 'group9_events_total{name="fanout \\"range\\""} 3' in text
+    assert 'group9_sql_calls_total{statement="SELECT COUNT FROM"} 1' in text
+    assert 'phase' not in text
+
+
+def test_outer_rows_reads_the_main_input_of_the_top_node():
+    plan = {'Actual Rows': 1, 'Plans': [{'Parent Relationship': 'InitPlan', 'Actual Rows': 9},
+                                        {'Parent Relationship': 'Outer', 'Actual Rows': 42}]}
+    assert instrumentation.outer_rows(plan) == 42
+    assert instrumentation.outer_rows({'Actual Rows': 7}) == 7
@@ -0,0 +1,51 @@
+#
+# Unit tests for the load and partitioning helpers of Group9_Assignment; no database needed.
+#
+
+import pytest
+
+from Group9_Assignment import _split_byte_ranges, range_boundaries, range_routing_query
+
+
+def write_lines(tmp_path, count):
+    path = tmp_path / 'ratings.dat'
+    path.write_bytes(b''.join(b'%d::%d::3::1\n' % (i, i * 7) for i in range(count)))
+    return str(path)
+
+
+@pytest.mark.parametrize('parts', [1, 2, 3, 8, 50])
+def test_byte_ranges_cover_the_file_on_line_boundaries(tmp_path, parts):
+    path = write_lines(tmp_path, 20)
+    data = open(path, 'rb').read()
+    ranges = _split_byte_ranges(path, parts)
+
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    assert len(ranges) <= parts
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+    for start, end in ranges:
+        assert end > start
+        assert start == 0 or data[start - 1:start] == b'\n'
+    assert b''.join(data[start:end] for start, end in ranges) == data
+
+
+def test_byte_ranges_stop_at_the_given_size(tmp_path):
+    path = write_lines(tmp_path, 10)
+    size = len(open(path, 'rb').read()) // 2
+    ranges = _split_byte_ranges(path, 4, size)
+    assert ranges[-1][1] == size
+    assert all(end <= size for _, end in ranges)
+
+
+@pytest.mark.parametrize('numberofpartitions', range(1, 40))
+def test_range_boundaries_end_exactly_at_five(numberofpartitions):
+    boundaries = range_boundaries(numberofpartitions)
+    assert len(boundaries) == numberofpartitions
+    assert boundaries[-1] == 5.0
+    assert boundaries == sorted(boundaries)
+
+
+def test_range_routing_query_sends_each_rating_to_the_first_boundary_at_or_above_it():
+    sql = range_routing_query('ratings', [1.0, 2.5, 5.0])
+    assert 'WHEN rating <= 1.0 THEN 0 WHEN rating <= 2.5 THEN 1 WHEN rating <= 5.0 THEN 2' in sql
+    assert 'WHERE rating >= 0 AND rating <= 5.0' in sql
@@ -0,0 +1,39 @@
+#
+# Unit tests for the declarative-partitioning bounds; no database needed.
+#
+
+import math
+
+import pytest
+
+from Group9_Assignment import range_boundaries
+from native_partitioning import range_partition_bounds
+
+
+def partition_of(bounds, rating):
+    matches = [i for i, (lower, upper) in enumerate(bounds) if lower <= rating < upper]
+    assert len(matches) <= 1
+    return matches[0] if matches else None
+
+
+@pytest.mark.parametrize('numberofpartitions', [1, 3, 5, 7, 10])
+def test_bounds_are_contiguous_from_zero(numberofpartitions):
+    bounds = range_partition_bounds(numberofpartitions)
+    assert len(bounds) == numberofpartitions
+    assert bounds[0][0] == 0.0
+    for (_, upper), (lower, _) in zip(bounds, bounds[1:]):
+        assert upper == lower
+
+
+@pytest.mark.parametrize('numberofpartitions', [1, 3, 5, 7, 10])
+def test_bounds_route_like_the_emulated_ranges(numberofpartitions):
+    bounds = range_partition_bounds(numberofpartitions)
+    boundaries = range_boundaries(numberofpartitions)
+    for i, boundary in enumerate(boundaries):
+        # Upper bounds are inclusive in the assignment's ranges.
+        assert partition_of(bounds, boundary) == i
+        if i + 1 < numberofpartitions:
+            assert partition_of(bounds, math.nextafter(boundary, math.inf)) == i + 1
+    assert partition_of(bounds, 0.0) == 0
+    assert partition_of(bounds, -0.5) is None
+    assert partition_of(bounds, math.nextafter(5.0, math.inf)) is None
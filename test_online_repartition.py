@@ -0,0 +1,37 @@
+#
+# Unit tests for the online repartitioning planner; no database needed.
+#
+
+from online_repartition import plan_range_repartition
+
+
+def test_unchanged_partitions_are_reused():
+    reused, sources = plan_range_repartition([1, 2, 3, 4, 5], [1, 2, 3, 4.5, 5])
+    assert reused == {0: 0, 1: 1, 2: 2}
+    assert sources == {3: [3, 4], 4: [4]}
+
+
+def test_split_and_merge_take_rows_from_every_overlapping_partition():
+    reused, sources = plan_range_repartition([2.5, 5], [1, 2, 3, 4, 5])
+    assert reused == {}
+    assert sources == {0: [0], 1: [0], 2: [0, 1], 3: [1], 4: [1]}
+
+    reused, sources = plan_range_repartition([1, 2, 3, 4, 5], [2.5, 5])
+    assert reused == {}
+    assert sources == {0: [0, 1, 2], 1: [2, 3, 4]}
+
+
+def test_repeated_boundaries_never_reuse_a_table_twice():
+    reused, sources = plan_range_repartition([3, 3.5, 4, 4, 5], [3, 4, 4, 4, 5])
+    assert reused == {0: 0, 4: 4}
+    assert sources == {1: [1, 2], 2: [], 3: []}
+    assert len(set(reused.values())) == len(reused)
+
+
+def test_every_old_partition_is_reused_or_feeds_a_new_one():
+    old = [0.5, 1, 1, 2, 3.5, 5]
+    reused, sources = plan_range_repartition(old, [1, 1, 1, 3, 5])
+    used = set(reused.values()) | {i for feeding in sources.values() for i in feeding}
+    # Partition 2, the empty (1, 1] interval, holds no rows and is simply dropped.
+    assert used == {0, 1, 3, 4, 5}
+    assert set(reused) | set(sources) == set(range(5))
@@ -0,0 +1,46 @@
+#
+# Unit tests for merging partial aggregates; no database needed.
+#
+
+from partition_aggregate import RatingAggregate
+
+
+def aggregate(*partials):
+    result = RatingAggregate()
+    for partial in partials:
+        result.add(*partial)
+    return result
+
+
+def test_add_accumulates_partials_and_histogram():
+    result = aggregate((3.0, 2, 6.5, 3.0, 3.5), (1.0, 1, 1.0, 1.0, 1.0), (3.0, 1, 3.0, 3.0, 3.0))
+    assert (result.count, result.sum, result.min, result.max) == (4, 10.5, 1.0, 3.5)
+    assert result.histogram == {3.0: 3, 1.0: 1}
+    assert result.avg == 10.5 / 4
+
+
+def test_merge_matches_a_single_aggregate_over_all_partials():
+    partials = [(0.5, 1, 0.5, 0.5, 0.5), (4.5, 3, 14.0, 4.5, 5.0), (2.0, 2, 4.5, 2.0, 2.5)]
+    merged = aggregate(partials[0])
+    merged.merge(aggregate(*partials[1:]))
+    assert merged.as_dict() == aggregate(*partials).as_dict()
+
+
+def test_merging_an_empty_aggregate_changes_nothing():
+    result = aggregate((None, 2, 5.0, 2.0, 3.0))
+    result.merge(RatingAggregate())
+    assert result.as_dict() == {'count': 2, 'sum': 5.0, 'avg': 2.5, 'min': 2.0, 'max': 3.0, 'histogram': {}}
+
+    empty = RatingAggregate()
+    empty.merge(result)
+    assert empty.as_dict() == result.as_dict()
+
+
+def test_empty_aggregate_has_no_average():
+    assert RatingAggregate().as_dict() == {'count': 0, 'sum': 0.0, 'avg': None, 'min': None, 'max': None,
+                                           'histogram': {}}
+
+
+def test_histogram_is_sorted_by_bucket():
+    result = aggregate((4.5, 1, 4.5, 4.5, 4.5), (0.0, 1, 0.0, 0.0, 0.0), (2.5, 1, 2.5, 2.5, 2.5))
+    assert list(result.as_dict()['histogram']) == [0.0, 2.5, 4.5]
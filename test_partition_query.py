@@ -0,0 +1,80 @@
+#
+# Unit tests for range partition pruning and predicate building; no database needed.
+#
+
+from Group9_Assignment import range_boundaries
+from partition_query import build_predicate, partition_tables, prune_range_partitions
+
+
+def test_no_bounds_keeps_every_partition():
+    assert prune_range_partitions(range_boundaries(5)) == [0, 1, 2, 3, 4]
+
+
+def test_bounds_prune_partitions_outside_the_interval():
+    boundaries = range_boundaries(5)  # [0, 1], (1, 2], (2, 3], (3, 4], (4, 5]
+    assert prune_range_partitions(boundaries, minrating=2.5) == [2, 3, 4]
+    assert prune_range_partitions(boundaries, maxrating=2.5) == [0, 1, 2]
+    assert prune_range_partitions(boundaries, 1.5, 3.5) == [1, 2, 3]
+    assert prune_range_partitions(boundaries, 3, 3) == [2]
+
+
+def test_a_rating_on_a_boundary_belongs_to_the_lower_partition():
+    boundaries = range_boundaries(5)
+    assert prune_range_partitions(boundaries, minrating=2) == [1, 2, 3, 4]
+    assert prune_range_partitions(boundaries, maxrating=2) == [0, 1]
+    assert prune_range_partitions(boundaries, 0, 0) == [0]
+    assert prune_range_partitions(boundaries, 5, 5) == [4]
+
+
+def test_empty_equidepth_partitions_are_pruned_with_their_neighbours():
+    boundaries = [3, 4, 4, 4, 5]  # [0, 3], (3, 4], (4, 4], (4, 4], (4, 5]
+    assert prune_range_partitions(boundaries, 4, 4) == [1]
+    assert prune_range_partitions(boundaries, minrating=4.5) == [4]
+
+
+def test_build_predicate():
+    assert build_predicate() == ('', [])
+    sql, params = build_predicate(minrating=1, maxrating=4, userid=7, movieid=9)
+    assert sql == ' WHERE rating >= %s AND rating <= %s AND userid = %s AND movieid = %s'
+    assert params == [1, 4, 7, 9]
+    assert build_predicate(movieid=3) == (' WHERE movieid = %s', [3])
+
+
+class _Cursor:
+    # Answers the metadata and fragment-count lookups of partition_tables.
+    def __init__(self, metadata, tables):
+        self.metadata = metadata
+        self.tables = tables
+        self.row = None
+
+    def execute(self, sql, params=None):
+        if 'to_regclass' in sql:
+            self.row = (self.metadata is not None,)
+        elif 'partition_metadata' in sql:
+            self.row = self.metadata
+        else:
+            self.row = (self.tables,)
+
+    def fetchone(self):
+        return self.row
+
+
+class _Connection:
+    def __init__(self, metadata=None, tables=0):
+        self.metadata = metadata
+        self.tables = tables
+
+    def cursor(self):
+        return _Cursor(self.metadata, self.tables)
+
+
+def test_partition_tables_without_any_layout_is_empty():
+    assert partition_tables('range', _Connection()) == []
+    assert partition_tables('roundrobin', _Connection()) == []
+
+
+def test_partition_tables_reads_the_layout_or_counts_fragments():
+    assert partition_tables('range', _Connection((1, 3, [1.0, 2.0, 5.0])), minrating=1.5) == [
+        'range_part1', 'range_part2']
+    assert partition_tables('range', _Connection(tables=2), maxrating=2) == ['range_part0']
+    assert partition_tables('roundrobin', _Connection((1, 2, None))) == ['rrobin_part0', 'rrobin_part1']
@@ -0,0 +1,143 @@
+#
+# Unit tests for ratings.dat parsing and validation; no database needed.
+#
+
+import io
+
+import pytest
+
+from Group9_Assignment import (VALID_RATING_LINE, RatingsFileReader, _complete_lines_end, _merge_rejects,
+                               parse_rating_line)
+
+RATINGS = (b"1::122::5::838985046\n"
+           b"1::185::4.5::838983525\r\n"
+           b"\n"
+           b"2::bad::3::838983392\n"
+           b"3::231::0.5::838983392\n"
+           b"4::292::7::838983421\n"
+           b"5::316::.5::838983392\n"
+           b"only::three::fields\n"
+           b"6::329::3::838983392")
+
+
+def write_ratings(tmp_path, data=RATINGS):
+    path = tmp_path / 'ratings.dat'
+    path.write_bytes(data)
+    return str(path)
+
+
+def copy_rows(data):
+    return [(int(userid), int(movieid), float(rating))
+            for userid, movieid, rating in (line.split(b'\t') for line in data.splitlines())]
+
+
+def read_all(reader):
+    chunks = []
+    while True:
+        chunk = reader.read()
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+@pytest.mark.parametrize('line', [
+    b'1::2::5::838985046',
+    b'1::2::5.0::838985046',
+    b'1::2::0::838985046',
+    b'1::2::4.5::838985046',
+    b'1::2::.5::838985046',
+    b'999999999::2::3::838985046\r',
+])
+def test_valid_lines_match(line):
+    assert VALID_RATING_LINE.fullmatch(line)
+
+
+@pytest.mark.parametrize('line', [
+    b'1::2::5.5::838985046',
+    b'1::2::6::838985046',
+    b'1::2::-1::838985046',
+    b'1234567890::2::3::838985046',
+    b'1::2::3',
+    b'1::2::3::later',
+    b'a::2::3::838985046',
+])
+def test_lines_needing_full_checks_do_not_match(line):
+    assert not VALID_RATING_LINE.fullmatch(line)
+
+
+def test_parse_rating_line_converts_to_copy_row():
+    assert parse_rating_line(b'1::122::5::838985046\r\n') == (b'1\t122\t5.0\n', None)
+    assert parse_rating_line(b' 7::8::2.5::1 ') == (b'7\t8\t2.5\n', None)
+    # Ids too long for the fast pattern are still accepted when they fit in INTEGER.
+    assert parse_rating_line(b'2147483647::1::1::1') == (b'2147483647\t1\t1.0\n', None)
+
+
+def test_parse_rating_line_skips_blank_lines():
+    assert parse_rating_line(b'') == (None, None)
+    assert parse_rating_line(b'  \r') == (None, None)
+
+
+@pytest.mark.parametrize('line, reason', [
+    (b'1::2::3', 'expected 4 fields, found 3'),
+    (b'1::2::3::4::5', 'expected 4 fields, found 5'),
+    (b'1::x::3::4', 'non-numeric field'),
+    (b'1::2::3::now', 'non-numeric field'),
+    (b'2147483648::2::3::4', 'id out of INTEGER range'),
+    (b'1::2::5.5::4', 'rating outside [0, 5]'),
+    (b'1::2::-0.5::4', 'rating outside [0, 5]'),
+])
+def test_parse_rating_line_reports_why_a_line_is_rejected(line, reason):
+    assert parse_rating_line(line) == (None, reason)
+
+
+@pytest.mark.parametrize('chunksize', [7, 64, 1 << 20])
+def test_reader_skips_and_numbers_rejected_lines(tmp_path, chunksize):
+    rejects = io.StringIO()
+    with RatingsFileReader(write_ratings(tmp_path), chunksize=chunksize, rejects=rejects) as reader:
+        data = read_all(reader)
+
+    # Clean blocks keep the rating text as written, checked blocks re-format it.
+    assert copy_rows(data) == [(1, 122, 5.0), (1, 185, 4.5), (3, 231, 0.5), (5, 316, 0.5), (6, 329, 3.0)]
+    assert (reader.rows, reader.lines, reader.rejected) == (5, 9, 3)
+    assert [line.split('\t')[:2] for line in rejects.getvalue().splitlines()] == [
+        ['4', 'non-numeric field'],
+        ['6', 'rating outside [0, 5]'],
+        ['8', 'expected 4 fields, found 3'],
+    ]
+
+
+def test_clean_blocks_take_the_fast_path(tmp_path):
+    path = write_ratings(tmp_path, b'1::2::3::4\n5::6::4.5::7\n')
+    with RatingsFileReader(path) as reader:
+        assert read_all(reader) == b'1\t2\t3\n5\t6\t4.5\n'
+    assert (reader.rows, reader.lines, reader.rejected) == (2, 2, 0)
+
+
+def test_reader_respects_the_byte_range(tmp_path):
+    path = write_ratings(tmp_path, b'1::2::3::4\n5::6::4::7\n8::9::1::2\n')
+    with RatingsFileReader(path, start=11, end=22) as reader:
+        assert read_all(reader) == b'5\t6\t4\n'
+    assert reader.position == 22
+
+
+def test_complete_lines_end_stops_after_the_last_newline(tmp_path):
+    assert _complete_lines_end(write_ratings(tmp_path, b'1::2::3::4\n12')) == 11
+    assert _complete_lines_end(write_ratings(tmp_path, b'1::2::3::4\n')) == 11
+    assert _complete_lines_end(write_ratings(tmp_path, b'1::2::3')) == 0
+
+
+def test_merged_rejects_continue_the_line_numbers_of_earlier_ranges(tmp_path):
+    first = tmp_path / 'rejects.part0'
+    second = tmp_path / 'rejects.part1'
+    first.write_text("2\tnon-numeric field\ta::1::1::1\n")
+    second.write_text("1\trating outside [0, 5]\t1::1::9::1\n3\texpected 4 fields, found 1\tx\n")
+    merged = tmp_path / 'rejects.txt'
+
+    _merge_rejects(str(merged), [str(first), str(second)], [4, 3])
+
+    assert merged.read_text().splitlines() == [
+        "2\tnon-numeric field\ta::1::1::1",
+        "5\trating outside [0, 5]\t1::1::9::1",
+        "7\texpected 4 fields, found 1\tx",
+    ]
+    assert not first.exists() and not second.exists()
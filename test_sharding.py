@@ -0,0 +1,46 @@
+#
+# Unit tests for shard placement and the COPY row router; no database needed.
+#
+
+import queue
+
+from sharding import ShardMap, _RoutingWriter
+
+
+def drain(chunks):
+    items = []
+    while not chunks.empty():
+        items.append(chunks.get_nowait())
+    return items
+
+
+def test_assign_spreads_fragments_over_nodes_in_turn():
+    shardmap = ShardMap.assign('range_part', 5, ['a', 'b'])
+    assert shardmap.placements == {'range_part0': 'a', 'range_part1': 'b', 'range_part2': 'a',
+                                   'range_part3': 'b', 'range_part4': 'a'}
+    assert shardmap.dsn('range_part3') == 'b'
+
+
+def test_routing_writer_splits_rows_by_part_column():
+    queues = [queue.Queue() for _ in range(3)]
+    writer = _RoutingWriter(queues)
+    writer.write(b'1\t10\t4.5\t2\n2\t20\t1\t0\n')
+    writer.write('3\t30\t3\t2\n')
+    writer.close()
+
+    assert writer.rows == 3
+    assert drain(queues[0]) == [b'2\t20\t1\n', None]
+    assert drain(queues[1]) == [None]
+    assert drain(queues[2]) == [b'1\t10\t4.5\n3\t30\t3\n', None]
+
+
+def test_routing_writer_flushes_full_buffers_before_close():
+    queues = [queue.Queue()]
+    writer = _RoutingWriter(queues, flushsize=9)
+    writer.write(b'1\t10\t4.5\t0\n')
+    assert drain(queues[0]) == [b'1\t10\t4.5\n']
+
+    writer.write(b'2\t2\t1\t0\n')
+    assert queues[0].empty()
+    writer.close()
+    assert drain(queues[0]) == [b'2\t2\t1\n', None]